@@ -0,0 +1,41 @@
+# Helpers shared by the tests
+
+from webtop import BACKENDS, NO_BACKEND, REASONS, Result
+from typing import Any, Optional
+import os
+import unittest
+
+try:
+    import numpy  # type: ignore # noqa: F401
+
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# numpy is only needed by webtop analyze and compare. CI installs it, so only local runs may skip
+requires_numpy = unittest.skipIf(not HAS_NUMPY and "TF_BUILD" not in os.environ, "requires numpy")
+
+SECOND = 1_000_000_000
+
+
+def make_result(
+    *,
+    timestamp: int = SECOND,
+    status: int = 200,
+    reason: Optional[str] = None,
+    elapsed_ns: int = 1_000_000,
+    response_bytes: int = 100,
+    backend: Optional[str] = None,
+    **fields: Any,
+) -> Result:
+    if reason is None:
+        reason = f"HTTP {status}" if status else "TimeoutError"
+    return Result(
+        status=status,
+        reason_id=REASONS.intern(reason),
+        elapsed_ns=elapsed_ns,
+        response_bytes=response_bytes,
+        timestamp=timestamp,
+        backend_id=BACKENDS.intern(backend) if backend is not None else NO_BACKEND,
+        **fields,
+    )
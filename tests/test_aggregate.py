@@ -0,0 +1,52 @@
+from tests.support import SECOND, make_result
+from webtop import REASONS, ResultAggregate
+import unittest
+
+
+class ResultAggregateTest(unittest.TestCase):
+    def test_add(self):
+        aggregate = ResultAggregate()
+        aggregate.add(make_result(timestamp=2 * SECOND, elapsed_ns=2_000_000, new_connection=True))
+        aggregate.add(make_result(timestamp=SECOND, status=503))
+        aggregate.add(make_result(timestamp=3 * SECOND, status=0))
+        self.assertEqual(len(aggregate), 3)
+        self.assertEqual(aggregate.no_successful_results, 1)
+        self.assertEqual(aggregate.no_responses, 2)
+        self.assertEqual(aggregate.no_new_connections, 1)
+        self.assertEqual(aggregate.sum_elapsed_ns, 3_000_000)
+        self.assertEqual(aggregate.latency_histogram.total_count, 2)
+        self.assertEqual(
+            aggregate.reason_counts,
+            {REASONS.intern("HTTP 200"): 1, REASONS.intern("HTTP 503"): 1, REASONS.intern("TimeoutError"): 1},
+        )
+        self.assertEqual(aggregate.span(), 1.0)
+
+    def test_remove_undoes_add(self):
+        aggregate = ResultAggregate()
+        result = make_result(status=503)
+        aggregate.add(make_result())
+        aggregate.add(result)
+        aggregate.remove(result)
+        self.assertEqual(len(aggregate), 1)
+        self.assertEqual(aggregate.reason_counts, {REASONS.intern("HTTP 200"): 1})
+        self.assertEqual(aggregate.reason_histograms.keys(), {REASONS.intern("HTTP 200")})
+        self.assertEqual(aggregate.sum_elapsed_ns, 1_000_000)
+
+    def test_subtract_undoes_merge(self):
+        base, other = ResultAggregate(), ResultAggregate()
+        base.add(make_result(timestamp=SECOND))
+        other.add(make_result(timestamp=2 * SECOND, status=503, elapsed_ns=5_000_000))
+        other.add(make_result(timestamp=3 * SECOND, status=0))
+        base.merge(other)
+        self.assertEqual(len(base), 3)
+        self.assertEqual(base.no_responses, 2)
+        self.assertEqual(base.span(), 2.0)
+        base.subtract(other)
+        self.assertEqual(len(base), 1)
+        self.assertEqual(base.no_successful_results, 1)
+        self.assertEqual(base.reason_counts, {REASONS.intern("HTTP 200"): 1})
+        self.assertEqual(base.latency_histogram.total_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+from tests.support import requires_numpy
+import unittest
+
+try:
+    import numpy as np  # type: ignore
+    from webtop import analysis
+except ImportError:
+    analysis = None  # type: ignore
+
+
+@requires_numpy
+class MannWhitneyUTest(unittest.TestCase):
+    def test_u_counts_pairs_where_the_candidate_is_larger(self):
+        rng = np.random.default_rng(1)
+        baseline = rng.integers(0, 50, 300)
+        candidate = rng.integers(3, 55, 200)
+        u, _, probability = analysis.mann_whitney_u(baseline, candidate)
+        # Ties count as half a pair each way
+        pairs = (candidate[:, None] > baseline[None, :]).sum() + 0.5 * (candidate[:, None] == baseline[None, :]).sum()
+        self.assertEqual(u, pairs)
+        self.assertAlmostEqual(probability, pairs / (len(baseline) * len(candidate)))
+
+    def test_identical_samples_are_not_significant(self):
+        values = np.arange(1_000)
+        _, p_value, probability = analysis.mann_whitney_u(values, values)
+        self.assertAlmostEqual(p_value, 1.0)
+        self.assertAlmostEqual(probability, 0.5)
+
+    def test_shifted_samples_are_significant(self):
+        rng = np.random.default_rng(2)
+        baseline = rng.normal(100, 10, 1_000)
+        _, p_value, probability = analysis.mann_whitney_u(baseline, baseline + 5)
+        self.assertLess(p_value, 0.001)
+        self.assertGreater(probability, 0.5)
+
+    def test_empty_samples(self):
+        self.assertEqual(analysis.mann_whitney_u(np.array([]), np.arange(3)), (0.0, 1.0, 0.5))
+
+
+@requires_numpy
+class SortedPercentilesTest(unittest.TestCase):
+    def test_nearest_rank(self):
+        values = np.arange(1, 101)
+        self.assertEqual(analysis.sorted_percentiles(values, [0.0, 50.0, 99.0, 99.9, 100.0]), [1, 50, 99, 100, 100])
+
+    def test_empty(self):
+        self.assertEqual(analysis.sorted_percentiles(np.array([]), [50.0, 99.0]), [0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
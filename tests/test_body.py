@@ -0,0 +1,29 @@
+from webtop import BodyTemplate, parse_args, reseed
+import random
+import unittest
+
+
+class BodyTemplateTest(unittest.TestCase):
+    def test_fields(self):
+        template = BodyTemplate('{"id": ${counter}, "n": ${random}, "price": "$$5"}')
+        template.random = random.Random(1)
+        expected = random.Random(1).getrandbits(32)
+        self.assertEqual(template.render(7), f'{{"id": 7, "n": {expected}, "price": "$5"}}'.encode())
+
+    def test_literal(self):
+        self.assertEqual(BodyTemplate("plain").render(0), b"plain")
+
+    def test_unknown_field(self):
+        with self.assertRaises(ValueError):
+            BodyTemplate("${nope}")
+
+    def test_reseed_gives_forked_processes_their_own_random_numbers(self):
+        args = parse_args(["http://localhost/", "--method", "POST", "--body-template", "${random}"])
+        args.body_template.random.seed(1)
+        inherited = args.body_template.random.getstate()
+        reseed(args)
+        self.assertNotEqual(args.body_template.random.getstate(), inherited)
+
+
+if __name__ == "__main__":
+    unittest.main()
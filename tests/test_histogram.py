@@ -0,0 +1,82 @@
+import random
+import unittest
+
+from webtop import Histogram
+
+
+class HistogramTest(unittest.TestCase):
+    def test_values_are_reproduced_to_significant_digits(self):
+        histogram = Histogram(significant_digits=3)
+        for value in (0, 1, 999, 1_000, 2_047, 2_048, 123_456, 987_654_321, 3_600_000_000_000):
+            index = histogram._index_of(value)
+            lowest = histogram._lowest_equivalent_value(index)
+            highest = histogram._highest_equivalent_value(index)
+            self.assertLessEqual(lowest, value)
+            self.assertGreaterEqual(highest, value)
+            self.assertLessEqual(highest - lowest, max(value / 1_000, 1))
+
+    def test_indexes_are_monotonic(self):
+        histogram = Histogram(significant_digits=2)
+        indexes = [histogram._index_of(value) for value in range(0, 100_000, 7)]
+        self.assertEqual(indexes, sorted(indexes))
+
+    def test_percentiles_are_nearest_rank(self):
+        histogram = Histogram(significant_digits=3)
+        for value in range(1, 1_001):
+            histogram.record(value * 1_000)
+        percentiles = histogram.percentiles([50.0, 90.0, 99.0, 100.0])
+        for percentile, expected in ((50.0, 500_000), (90.0, 900_000), (99.0, 990_000), (100.0, 1_000_000)):
+            self.assertAlmostEqual(percentiles[percentile], expected, delta=expected / 1_000)
+        self.assertEqual(histogram.min(), 1_000)
+        self.assertAlmostEqual(histogram.max(), 1_000_000, delta=1_000)
+
+    def test_empty_histogram(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.percentiles([50.0, 99.0]), {50.0: 0, 99.0: 0})
+        self.assertEqual(histogram.min(), 0)
+        self.assertEqual(histogram.max(), 0)
+
+    def test_merge_matches_recording_everything_in_one(self):
+        rng = random.Random(1)
+        values = [rng.randrange(1, 10_000_000) for _ in range(2_000)]
+        first, second, combined = Histogram(), Histogram(), Histogram()
+        for index, value in enumerate(values):
+            (first if index % 2 else second).record(value)
+            combined.record(value)
+        first.merge(second)
+        self.assertEqual(first.counts, combined.counts)
+        self.assertEqual(first.total_count, combined.total_count)
+
+    def test_subtract_undoes_merge(self):
+        base, other = Histogram(), Histogram()
+        for value in (10, 20, 30):
+            base.record(value)
+        for value in (20, 40_000):
+            other.record(value)
+        expected = dict(base.counts)
+        base.merge(other)
+        base.subtract(other)
+        self.assertEqual(base.counts, expected)
+        self.assertEqual(base.total_count, 3)
+
+    def test_remove_drops_empty_buckets(self):
+        histogram = Histogram()
+        histogram.record(5, count=2)
+        histogram.remove(5)
+        histogram.remove(5)
+        self.assertEqual(histogram.counts, {})
+        self.assertEqual(histogram.total_count, 0)
+
+    def test_merge_rejects_different_precision(self):
+        with self.assertRaises(ValueError):
+            Histogram(significant_digits=2).merge(Histogram(significant_digits=3))
+
+    def test_cumulative_counts(self):
+        histogram = Histogram()
+        for value in (1, 2, 3, 1_000, 1_000_000):
+            histogram.record(value)
+        self.assertEqual(histogram.cumulative_counts([0, 3, 999, 1_000, 10_000_000]), [0, 3, 3, 4, 5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+from tests.support import SECOND, make_result
+from webtop import REASONS, ResultAggregate, ResultHistory
+import unittest
+
+
+class ResultHistoryTest(unittest.TestCase):
+    def test_keeps_the_newest_results_in_order(self):
+        history = ResultHistory(maxlen=3)
+        for index in range(5):
+            history.append(make_result(timestamp=index * SECOND, elapsed_ns=index + 1))
+        self.assertEqual(len(history), 3)
+        self.assertEqual([result.timestamp for result in history], [2 * SECOND, 3 * SECOND, 4 * SECOND])
+
+    def test_results_round_trip_through_the_columns(self):
+        history = ResultHistory(maxlen=2)
+        result = make_result(
+            status=503,
+            backend="10.0.0.1",
+            request_bytes=42,
+            new_connection=True,
+            phases_ns=(1, 2, -1, 4, 5),
+            checksum=99,
+            checksum_mismatch=True,
+            scenario_id=3,
+        )
+        history.append(result)
+        (loaded,) = history
+        for field in result.__slots__:
+            self.assertEqual(getattr(loaded, field), getattr(result, field), field)
+
+    def test_aggregate_matches_the_results_held(self):
+        history = ResultHistory(maxlen=4)
+        statuses = [200, 503, 0, 200, 404, 200, 0]
+        for index, status in enumerate(statuses):
+            history.append(make_result(timestamp=index * SECOND, status=status, elapsed_ns=(index + 1) * 1_000))
+            expected = ResultAggregate()
+            for result in history:
+                expected.add(result)
+            aggregate = history.aggregate
+            self.assertEqual(len(aggregate), len(expected))
+            self.assertEqual(aggregate.no_successful_results, expected.no_successful_results)
+            self.assertEqual(aggregate.no_responses, expected.no_responses)
+            self.assertEqual(aggregate.sum_elapsed_ns, expected.sum_elapsed_ns)
+            self.assertEqual(aggregate.reason_counts, expected.reason_counts)
+            self.assertEqual(aggregate.latency_histogram.counts, expected.latency_histogram.counts)
+            self.assertEqual(aggregate.oldest_timestamp, max(index - 3, 0) * SECOND)
+            self.assertEqual(aggregate.newest_timestamp, index * SECOND)
+        self.assertNotIn(REASONS.intern("HTTP 503"), history.aggregate.reason_counts)
+
+
+if __name__ == "__main__":
+    unittest.main()
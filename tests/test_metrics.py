@@ -0,0 +1,61 @@
+from tests.support import make_result
+from webtop import ConnectionStats, ResultAggregate, build_metrics, build_run_stats, parse_args
+from typing import Dict, List
+import unittest
+
+
+def samples(text: str) -> Dict[str, str]:
+    lines = [line for line in text.splitlines() if not line.startswith("#")]
+    return dict(line.rsplit(" ", 1) for line in lines)
+
+
+class BuildMetricsTest(unittest.TestCase):
+    def metrics(self, argv: List[str], results: List) -> str:
+        args = parse_args(["http://localhost/", *argv])
+        stats = build_run_stats(args, results=ResultAggregate(), connections=ConnectionStats())
+        for result in results:
+            stats.results.add(result)
+            stats.totals.add(result)
+        return build_metrics(stats)
+
+    def test_samples(self):
+        text = self.metrics(
+            [],
+            [
+                make_result(elapsed_ns=2_000_000, backend="10.0.0.1", new_connection=True),
+                make_result(elapsed_ns=30_000_000, backend="10.0.0.1"),
+                make_result(status=503, elapsed_ns=700_000_000, backend='a"b'),
+            ],
+        )
+        values = samples(text)
+        self.assertEqual(values['webtop_requests_total{reason="HTTP 200"}'], "2")
+        self.assertEqual(values['webtop_requests_total{reason="HTTP 503"}'], "1")
+        self.assertEqual(values['webtop_backend_requests_total{backend="10.0.0.1"}'], "2")
+        self.assertEqual(values['webtop_backend_requests_total{backend="a\\"b"}'], "1")
+        self.assertEqual(values["webtop_successful_requests_total"], "2")
+        self.assertEqual(float(values["webtop_success_ratio"]), 2 / 3)
+        self.assertEqual(values['webtop_request_duration_seconds_bucket{le="0.001"}'], "0")
+        self.assertEqual(values['webtop_request_duration_seconds_bucket{le="0.0025"}'], "1")
+        self.assertEqual(values['webtop_request_duration_seconds_bucket{le="0.05"}'], "2")
+        self.assertEqual(values['webtop_request_duration_seconds_bucket{le="1"}'], "3")
+        self.assertEqual(values['webtop_request_duration_seconds_bucket{le="+Inf"}'], "3")
+        self.assertEqual(values["webtop_request_duration_seconds_sum"], "0.732")
+        self.assertEqual(values["webtop_request_duration_seconds_count"], "3")
+        self.assertEqual(values["webtop_new_connections_total"], "1")
+        self.assertNotIn("webtop_scheduled_requests_total", values)
+
+    def test_counters_keep_every_digit(self):
+        text = self.metrics(["--rate", "10/s"], [])
+        self.assertIn("webtop_scheduled_requests_total 0\n", text)
+        args = parse_args(["http://localhost/"])
+        stats = build_run_stats(args, results=ResultAggregate(), connections=ConnectionStats())
+        stats.connections.no_dns_lookups = 1_234_567
+        stats.totals.sum_elapsed_ns = 1_234_567_891_234
+        values = samples(build_metrics(stats))
+        self.assertEqual(values["webtop_dns_lookups_total"], "1234567")
+        self.assertEqual(values["webtop_request_duration_seconds_sum"], "1234.567891234")
+        self.assertEqual(values["webtop_success_ratio"], "0.0")
+
+
+if __name__ == "__main__":
+    unittest.main()
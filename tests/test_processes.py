@@ -0,0 +1,95 @@
+from tests.support import make_result
+from webtop import BACKENDS, REASONS, ResultAggregate, SharedSnapshot, are_args_valid, load_process_args, parse_args
+from typing import Any
+import multiprocessing
+import pickle
+import unittest
+
+
+def publish_aggregate(snapshot: SharedSnapshot) -> None:
+    # Interned here first, so these reasons get other ids in the child than the parent would give them
+    for index in range(5):
+        REASONS.intern(f"Child reason {index}")
+    aggregate = ResultAggregate(significant_digits=5)
+    for index in range(20_000):
+        aggregate.add(
+            make_result(
+                status=500 + index % 5,
+                reason=f"Child reason {index % 5}",
+                elapsed_ns=1_000 + index * 7_919,
+                backend=f"10.0.0.{index % 50}",
+            )
+        )
+    snapshot.publish(aggregate)
+
+
+class SharedSnapshotTest(unittest.TestCase):
+    def snapshot(self, **kwargs: Any) -> SharedSnapshot:
+        snapshot = SharedSnapshot(**kwargs)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_read_before_publish(self):
+        self.assertIsNone(self.snapshot().read())
+
+    def test_round_trip(self):
+        snapshot = self.snapshot()
+        snapshot.publish({"a": 1})
+        self.assertEqual(snapshot.read(), {"a": 1})
+        snapshot.publish({"a": 2})
+        self.assertEqual(snapshot.read(), {"a": 2})
+
+    def test_grows_to_fit_snapshots_from_another_process(self):
+        snapshot = self.snapshot(capacity=1024)
+        process = multiprocessing.get_context("fork").Process(target=publish_aggregate, args=(snapshot,))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+        aggregate = snapshot.read()
+        self.assertGreater(len(pickle.dumps(aggregate)), 1024)
+        self.assertEqual(len(aggregate), 20_000)
+        # Ids were interned again by name in this process
+        self.assertEqual(
+            {REASONS.name(reason_id): count for reason_id, count in aggregate.reason_counts.items()},
+            {f"Child reason {index}": 4_000 for index in range(5)},
+        )
+        self.assertEqual(
+            {REASONS.name(reason_id) for reason_id in aggregate.reason_histograms},
+            {f"Child reason {index}" for index in range(5)},
+        )
+        self.assertEqual(
+            {BACKENDS.name(backend_id) for backend_id in aggregate.backends}, {f"10.0.0.{index}" for index in range(50)}
+        )
+
+    def test_smaller_snapshots_after_growing(self):
+        snapshot = self.snapshot(capacity=16)
+        snapshot.publish(list(range(1000)))
+        snapshot.publish([1])
+        self.assertEqual(snapshot.read(), [1])
+
+
+class LoadProcessArgsTest(unittest.TestCase):
+    def test_load_is_split_across_processes(self):
+        args = parse_args(["http://localhost/", "-p", "3", "-k", "10", "--max-connections", "4", "--rate", "30/s"])
+        process_args = [load_process_args(args, processes=3, index=index) for index in range(3)]
+        self.assertEqual([process.workers for process in process_args], [4, 3, 3])
+        self.assertEqual([process.max_connections for process in process_args], [2, 1, 1])
+        self.assertEqual([process.rate for process in process_args], ["10.0/s"] * 3)
+        self.assertEqual([process.process_index for process in process_args], [0, 1, 2])
+
+    def test_no_connection_limit_stays_unlimited(self):
+        args = parse_args(["http://localhost/", "-p", "2", "-k", "2"])
+        self.assertEqual(load_process_args(args, processes=2, index=1).max_connections, 0)
+
+    def test_connection_limit_must_cover_every_process(self):
+        self.assertTrue(
+            are_args_valid(parse_args(["http://localhost/", "-p", "2", "-k", "2", "--max-connections", "2"]))
+        )
+        self.assertFalse(
+            are_args_valid(parse_args(["http://localhost/", "-p", "2", "-k", "2", "--max-connections", "1"]))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+from tests.support import SECOND, make_result, requires_numpy
+from webtop import RECORD, TRAILER_MAGIC, BatchWriter, Result, ResultRecorder
+from typing import Any, List
+import io
+import os
+import tempfile
+import unittest
+
+try:
+    from webtop import analysis
+except ImportError:
+    analysis = None  # type: ignore
+
+
+def recorded_result(index: int, **fields: Any) -> Result:
+    fields.setdefault("backend", "10.0.0.1")
+    return make_result(
+        timestamp=SECOND + index * 1_000,
+        elapsed_ns=1_000_000 + index,
+        response_bytes=100 + index,
+        request_bytes=50,
+        new_connection=index == 0,
+        phases_ns=(-1, 10, -1, 20 + index, 30),
+        checksum=7,
+        checksum_mismatch=index == 2,
+        scenario_id=index % 2,
+        **fields,
+    )
+
+
+class BatchWriterTest(unittest.TestCase):
+    def test_subclasses_must_format_batches(self):
+        class Unformatted(BatchWriter):
+            pass
+
+        with self.assertRaises(TypeError):
+            Unformatted(file=io.BytesIO())  # type: ignore
+
+    def test_batches_are_formatted_and_written_on_close(self):
+        class Counting(BatchWriter):
+            def _format(self, batch: List[Result]) -> bytes:
+                return f"{len(batch)}\n".encode()
+
+        file = io.BytesIO()
+        file.close = lambda: None  # type: ignore
+        writer = Counting(file=file)
+        for index in range(3):
+            writer.log(recorded_result(index))
+        writer.close()
+        self.assertEqual(file.getvalue(), b"3\n")
+
+
+@requires_numpy
+class RecordingTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def record(self, results: List[Result], name: str = "run.bin") -> str:
+        path = os.path.join(self.directory, name)
+        recorder = ResultRecorder(path=path, header={"url": "http://example.com/", "method": "GET"})
+        for result in results:
+            recorder.log(result)
+        recorder.close()
+        return path
+
+    def test_round_trip(self):
+        results = [recorded_result(index) for index in range(5)] + [recorded_result(5, status=0)]
+        recording = analysis.load_recording(self.record(results))
+        self.assertEqual(recording.header["url"], "http://example.com/")
+        self.assertEqual(recording.header["record_size"], RECORD.size)
+        records = recording.records
+        self.assertEqual(len(records), len(results))
+        for record, result in zip(records, results):
+            self.assertEqual(int(record["timestamp_ns"]), result.timestamp)
+            self.assertEqual(int(record["elapsed_ns"]), result.elapsed_ns)
+            self.assertEqual(int(record["response_bytes"]), result.response_bytes)
+            self.assertEqual(int(record["request_bytes"]), result.request_bytes)
+            self.assertEqual(int(record["status"]), result.status)
+            self.assertEqual(int(record["scenario_id"]), result.scenario_id)
+            self.assertEqual(recording.reasons[int(record["reason_id"])], result.reason)
+            self.assertEqual(recording.backends[int(record["backend_id"])], "10.0.0.1")
+            self.assertEqual(bool(record["new_connection"]), result.new_connection)
+            self.assertEqual(int(record["checksum"]), 2 if result.checksum_mismatch else 1)
+            self.assertEqual(int(record["ttfb_ns"]), result.phases_ns[3])
+            self.assertEqual(int(record["dns_ns"]), -1)
+
+    def test_recording_without_trailer_is_readable(self):
+        path = self.record([recorded_result(index) for index in range(3)])
+        with open(path, "rb") as f:
+            data = f.read()
+        self.assertTrue(data.endswith(TRAILER_MAGIC))
+        # Cut the recording off at the start of its trailer, as if the run had been killed
+        with open(path, "wb") as f:
+            f.write(data[: data.rindex(b'{"reasons"')])
+
+        recording = analysis.load_recording(path)
+        self.assertEqual(len(recording.records), 3)
+        self.assertEqual(recording.reasons, [])
+        columns, reason_names, _ = analysis.combine_recordings([recording])
+        self.assertEqual(len(columns["status"]), 3)
+        self.assertEqual(len(reason_names), 1)
+
+    def test_rejects_other_files(self):
+        path = os.path.join(self.directory, "other.bin")
+        with open(path, "wb") as f:
+            f.write(b"not a recording")
+        with self.assertRaises(ValueError):
+            analysis.load_recording(path)
+
+    def test_combine_sorts_and_translates_ids(self):
+        first = analysis.load_recording(self.record([recorded_result(index) for index in (4, 2)], "run.bin.0"))
+        second = analysis.load_recording(
+            self.record([recorded_result(index, status=503, backend="10.0.0.2") for index in (3, 1)], "run.bin.1")
+        )
+        # Another process would have interned names in its own order
+        second.records = second.records.copy()
+        second.records["reason_id"] += 1
+        second.reasons = ["Another Reason"] + second.reasons
+
+        columns, reason_names, backend_names = analysis.combine_recordings([first, second])
+        self.assertEqual([int(timestamp) for timestamp in columns["timestamp_ns"]], sorted(columns["timestamp_ns"]))
+        self.assertEqual(len(columns["status"]), 4)
+        for status, reason_id, backend_id in zip(columns["status"], columns["reason_id"], columns["backend_id"]):
+            self.assertEqual(reason_names[reason_id], f"HTTP {status}")
+            self.assertEqual(backend_names[backend_id], "10.0.0.2" if status == 503 else "10.0.0.1")
+
+    def test_recording_paths_expand_process_files(self):
+        for index in (0, 1, 10, 2):
+            self.record([recorded_result(index)], f"run.bin.{index}")
+        base = os.path.join(self.directory, "run.bin")
+        self.assertEqual(analysis.recording_paths(base), [f"{base}.{index}" for index in (0, 1, 2, 10)])
+        self.assertEqual(analysis.recording_paths(f"{base}.1"), [f"{base}.1"])
+        # Files which merely start like a process recording are not one
+        self.record([recorded_result(0)], "run.bin.1.bak")
+        self.assertEqual(analysis.recording_paths(base), [f"{base}.{index}" for index in (0, 1, 2, 10)])
+        # A single process recording left next to them may be from another run, so neither set is picked
+        self.record([recorded_result(0)])
+        with self.assertRaises(ValueError):
+            analysis.recording_paths(base)
+
+    def test_recording_paths_without_process_files(self):
+        path = self.record([recorded_result(0)])
+        self.assertEqual(analysis.recording_paths(path), [path])
+        missing = os.path.join(self.directory, "missing.bin")
+        self.assertEqual(analysis.recording_paths(missing), [missing])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+from webtop import TerminalRenderer
+from unittest import mock
+import io
+import os
+import unittest
+
+
+class TerminalRendererTest(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.renderer = TerminalRenderer(stream=self.stream)
+        patcher = mock.patch("webtop.shutil.get_terminal_size", return_value=os.terminal_size((10, 4)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def draw(self, output: str) -> str:
+        self.stream.seek(0)
+        self.stream.truncate()
+        self.renderer.draw(output)
+        return self.stream.getvalue()
+
+    def test_first_frame_clears_the_screen(self):
+        self.assertEqual(self.draw("a\nb"), "\x1b[2J\x1b[?25l\x1b[1;1Ha\x1b[K\x1b[2;1Hb\x1b[K")
+
+    def test_only_changed_lines_are_redrawn(self):
+        self.draw("a\nb\nc")
+        self.assertEqual(self.draw("a\nB\nc"), "\x1b[2;1HB\x1b[K")
+        self.assertEqual(self.draw("a\nB\nc"), "")
+
+    def test_shorter_frames_clear_below(self):
+        self.draw("a\nb\nc")
+        self.assertEqual(self.draw("a"), "\x1b[2;1H\x1b[J")
+
+    def test_lines_are_cut_to_the_terminal(self):
+        self.draw("0123456789abc\n2\n3\n4\n5")
+        self.assertEqual(self.renderer.lines, ["0123456789", "2", "3"])
+
+    def test_stop_clears_the_frame_and_shows_the_cursor(self):
+        self.renderer.stop()
+        self.assertEqual(self.stream.getvalue(), "")
+        self.draw("a")
+        self.stream.seek(0)
+        self.stream.truncate()
+        self.renderer.stop()
+        self.assertEqual(self.stream.getvalue(), "\x1b[H\x1b[J\x1b[?25h")
+        self.assertIsNone(self.renderer.lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
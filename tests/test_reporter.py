@@ -0,0 +1,69 @@
+from tests.support import make_result
+from webtop import ConnectionStats, ResultAggregate, RunStats, build_run_stats, interval_report, parse_args, reporter
+from typing import List
+import asyncio
+import contextlib
+import io
+import json
+import unittest
+
+
+class IntervalReportTest(unittest.TestCase):
+    def test_report(self):
+        results = ResultAggregate()
+        for elapsed_ns in (1_000_000, 2_000_000, 3_000_000):
+            results.add(make_result(elapsed_ns=elapsed_ns, response_bytes=100, request_bytes=10))
+        results.add(make_result(status=503, elapsed_ns=4_000_000, response_bytes=100, request_bytes=10))
+        report = interval_report(results, 2.0, in_flight=5)
+        self.assertEqual(report["interval_ns"], 2_000_000_000)
+        self.assertEqual(report["requests"], 4)
+        self.assertEqual(report["successful_requests"], 3)
+        self.assertEqual(report["success_ratio"], 0.75)
+        self.assertEqual(report["requests_per_second"], 2.0)
+        self.assertEqual(report["response_bytes_per_second"], 200.0)
+        self.assertEqual(report["request_bytes_per_second"], 20.0)
+        self.assertEqual(list(report["latency_ns"]), ["p50", "p90", "p99", "max"])
+        self.assertAlmostEqual(report["latency_ns"]["p50"], 2_000_000, delta=2_000)
+        self.assertAlmostEqual(report["latency_ns"]["max"], 4_000_000, delta=4_000)
+        self.assertEqual(report["reasons"], {"HTTP 200": 3, "HTTP 503": 1})
+        self.assertEqual(report["in_flight"], 5)
+
+    def test_empty_interval(self):
+        report = interval_report(ResultAggregate(), 1.0, in_flight=0)
+        self.assertEqual(report["requests"], 0)
+        self.assertIsNone(report["success_ratio"])
+        self.assertEqual(report["reasons"], {})
+
+
+class ReporterTest(unittest.TestCase):
+    def test_each_line_reports_only_its_own_interval(self):
+        args = parse_args(["http://localhost/", "--headless", "true", "--report-interval", "10ms"])
+        stats = build_run_stats(args, results=ResultAggregate(), connections=ConnectionStats())
+        # Results completed by the end of each interval
+        intervals: List[List[int]] = [[200, 200, 503], [200, 0]]
+
+        async def run() -> None:
+            shutdown_event = asyncio.Event()
+
+            def get_stats() -> RunStats:
+                for status in intervals.pop(0):
+                    stats.totals.add(make_result(status=status))
+                if not intervals:
+                    shutdown_event.set()
+                return stats
+
+            await reporter(args=args, get_stats=get_stats, shutdown_event=shutdown_event)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            asyncio.run(run())
+        reports = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([report["requests"] for report in reports], [3, 2])
+        self.assertEqual(reports[0]["reasons"], {"HTTP 200": 2, "HTTP 503": 1})
+        # Reasons which did not occur in an interval are left out rather than reported as 0
+        self.assertEqual(reports[1]["reasons"], {"HTTP 200": 1, "TimeoutError": 1})
+        self.assertEqual(len(stats.totals), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
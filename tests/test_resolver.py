@@ -0,0 +1,165 @@
+from webtop import DEFAULT_DNS_TTL, CachingResolver, ConnectionStats, parse_resolve
+from typing import Any, Dict, List, Optional
+import aiodns  # type: ignore
+import aiohttp
+import asyncio
+import socket
+import time
+import unittest
+
+
+class FakeResolver(aiohttp.resolver.AbstractResolver):
+    def __init__(self, addresses: List[str]):
+        self.addresses = addresses
+        self.lookups = 0
+        self.release: Optional[asyncio.Event] = None
+        self.error: Optional[Exception] = None
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict[str, Any]]:
+        self.lookups += 1
+        if self.release is not None:
+            await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return [{"hostname": host, "host": address, "port": port, "family": family} for address in self.addresses]
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeRecord(object):
+    def __init__(self, host: str, ttl: int):
+        self.host = host
+        self.ttl = ttl
+
+
+class FakeDNS(object):
+    def __init__(self, records: Dict[str, List[FakeRecord]]):
+        self.records = records
+
+    async def query(self, host: str, record_type: str) -> List[FakeRecord]:
+        if record_type not in self.records:
+            raise aiodns.error.DNSError(4, "Domain name not found")
+        return self.records[record_type]
+
+
+class CachingResolverTest(unittest.TestCase):
+    def run_resolver(
+        self, test: Any, *, addresses: List[str], records: Dict[str, List[FakeRecord]], **kwargs: Any
+    ) -> ConnectionStats:
+        stats = ConnectionStats()
+
+        async def run() -> None:
+            fake = FakeResolver(addresses)
+            resolver = CachingResolver(stats=stats, resolver=fake, **kwargs)
+            resolver.dns = FakeDNS(records)
+            await test(resolver, fake)
+
+        asyncio.run(run())
+        return stats
+
+    def test_addresses_are_cached_for_the_smallest_ttl(self):
+        async def test(resolver: CachingResolver, fake: FakeResolver) -> None:
+            await resolver.resolve("example.com", 80)
+            await resolver.resolve("example.com", 80)
+            self.assertEqual(fake.lookups, 1)
+            remaining = resolver.cache[("example.com", socket.AF_INET)].expires - time.monotonic()
+            self.assertAlmostEqual(remaining, 30, delta=1)
+            # Once expired, the next connection looks the name up again
+            resolver.cache[("example.com", socket.AF_INET)].expires = time.monotonic()
+            await resolver.resolve("example.com", 80)
+            self.assertEqual(fake.lookups, 2)
+
+        records = {"A": [FakeRecord("10.0.0.1", 60), FakeRecord("10.0.0.2", 30)]}
+        stats = self.run_resolver(test, addresses=["10.0.0.1", "10.0.0.2"], records=records)
+        self.assertEqual(stats.no_dns_lookups, 2)
+        self.assertEqual(stats.no_dns_cache_hits, 1)
+
+    def test_addresses_without_records_get_the_default_ttl(self):
+        async def test(resolver: CachingResolver, fake: FakeResolver) -> None:
+            await resolver.resolve("localhost", 80)
+            remaining = resolver.cache[("localhost", socket.AF_INET)].expires - time.monotonic()
+            self.assertAlmostEqual(remaining, DEFAULT_DNS_TTL, delta=1)
+
+        self.run_resolver(test, addresses=["127.0.0.1"], records={})
+
+    def test_zero_ttl_is_not_cached(self):
+        async def test(resolver: CachingResolver, fake: FakeResolver) -> None:
+            await resolver.resolve("example.com", 80)
+            await resolver.resolve("example.com", 80)
+            self.assertEqual(fake.lookups, 2)
+
+        stats = self.run_resolver(test, addresses=["10.0.0.1"], records={}, ttl=0)
+        self.assertEqual(stats.no_dns_cache_hits, 0)
+
+    def test_round_robin_rotates_through_the_addresses(self):
+        async def test(resolver: CachingResolver, fake: FakeResolver) -> None:
+            firsts = [(await resolver.resolve("example.com", 443))[0] for _ in range(4)]
+            self.assertEqual([first["host"] for first in firsts], ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.1"])
+            self.assertEqual({first["port"] for first in firsts}, {443})
+
+        self.run_resolver(test, addresses=["10.0.0.1", "10.0.0.2", "10.0.0.3"], records={}, ttl=60)
+
+    def test_random_spread_returns_every_address(self):
+        async def test(resolver: CachingResolver, fake: FakeResolver) -> None:
+            for _ in range(10):
+                addresses = await resolver.resolve("example.com", 80)
+                self.assertEqual(sorted(address["host"] for address in addresses), ["10.0.0.1", "10.0.0.2"])
+
+        self.run_resolver(test, addresses=["10.0.0.1", "10.0.0.2"], records={}, ttl=60, spread="random")
+
+    def test_concurrent_lookups_are_shared(self):
+        async def test(resolver: CachingResolver, fake: FakeResolver) -> None:
+            fake.release = asyncio.Event()
+            lookups = [asyncio.ensure_future(resolver.resolve("example.com", 80)) for _ in range(3)]
+            await asyncio.sleep(0)
+            fake.release.set()
+            results = await asyncio.gather(*lookups)
+            self.assertEqual(fake.lookups, 1)
+            self.assertEqual([result[0]["host"] for result in results], ["10.0.0.1", "10.0.0.2", "10.0.0.1"])
+            self.assertEqual(resolver.pending, {})
+
+        stats = self.run_resolver(test, addresses=["10.0.0.1", "10.0.0.2"], records={}, ttl=60)
+        self.assertEqual(stats.no_dns_lookups, 1)
+        self.assertEqual(stats.no_dns_shared_lookups, 2)
+        self.assertEqual(stats.no_dns_cache_hits, 0)
+
+    def test_failed_shared_lookups_fail_every_waiter(self):
+        async def test(resolver: CachingResolver, fake: FakeResolver) -> None:
+            fake.release = asyncio.Event()
+            fake.error = OSError("lookup failed")
+            lookups = [asyncio.ensure_future(resolver.resolve("example.com", 80)) for _ in range(2)]
+            await asyncio.sleep(0)
+            fake.release.set()
+            results = await asyncio.gather(*lookups, return_exceptions=True)
+            self.assertEqual([type(result) for result in results], [OSError, OSError])
+            self.assertEqual(resolver.pending, {})
+            self.assertEqual(resolver.cache, {})
+            # The failure is not cached, so the next connection tries again
+            fake.release = None
+            fake.error = None
+            await resolver.resolve("example.com", 80)
+            self.assertEqual(fake.lookups, 2)
+
+        stats = self.run_resolver(test, addresses=["10.0.0.1"], records={}, ttl=60)
+        self.assertEqual(stats.no_dns_lookups, 2)
+        self.assertEqual(stats.no_dns_shared_lookups, 1)
+
+
+class ParseResolveTest(unittest.TestCase):
+    def test_mappings(self):
+        self.assertEqual(
+            parse_resolve(["example.com:10.0.0.1,10.0.0.2", "example.com:[::1]", "other:127.0.0.1"]),
+            {"example.com": ["10.0.0.1", "10.0.0.2", "::1"], "other": ["127.0.0.1"]},
+        )
+
+    def test_invalid_address(self):
+        with self.assertRaises(ValueError):
+            parse_resolve(["example.com:not-an-address"])
+
+    def test_none(self):
+        self.assertEqual(parse_resolve(None), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,22 @@
+from webtop import build_alias_table
+import unittest
+
+
+class AliasTableTest(unittest.TestCase):
+    def test_picks_follow_weights(self):
+        weights = [8.0, 2.0, 0.5, 1.5]
+        probabilities, aliases = build_alias_table(weights)
+        # Each slot is picked 1/n of the time, and gives its own index with its probability, otherwise its alias
+        picked = [0.0] * len(weights)
+        for slot, (probability, alias) in enumerate(zip(probabilities, aliases)):
+            picked[slot] += probability / len(weights)
+            picked[alias] += (1.0 - probability) / len(weights)
+        for share, weight in zip(picked, weights):
+            self.assertAlmostEqual(share, weight / sum(weights))
+
+    def test_single_entry(self):
+        self.assertEqual(build_alias_table([3.0]), ([1.0], [0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+from aiohttp import web
+from webtop import ResultHistory, ScheduleStats, build_connector, build_run_stats, generate_load, parse_args
+from typing import Tuple
+import asyncio
+import socket
+import time
+import unittest
+
+
+class SchedulerTest(unittest.TestCase):
+    def run_schedule(
+        self, *, rate: str, workers: int, seconds: float, delay: float, stall: float = 0
+    ) -> Tuple[ScheduleStats, int]:
+        async def handle(request: web.Request) -> web.Response:
+            await asyncio.sleep(delay)
+            return web.Response(text="ok")
+
+        async def run() -> Tuple[ScheduleStats, int]:
+            app = web.Application()
+            app.router.add_get("/", handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            sock = socket.socket()
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+            await web.SockSite(runner, sock).start()
+            try:
+                args = parse_args([f"http://127.0.0.1:{port}/", "--rate", rate, "-k", str(workers)])
+                results = ResultHistory(maxlen=args.request_history)
+                connector = build_connector(args)
+                stats = build_run_stats(args, results=results.aggregate, connections=connector.stats)
+                shutdown_event = asyncio.Event()
+                loop = asyncio.get_event_loop()
+                loop.call_later(seconds, shutdown_event.set)
+                if stall:
+                    # Block the event loop, as a slow callback would, so the slots due meanwhile are sent late
+                    loop.call_later(seconds / 2, time.sleep, stall)
+                await generate_load(
+                    args=args, results=results, stats=stats, connector=connector, shutdown_event=shutdown_event
+                )
+                return stats.schedule, len(stats.totals)
+            finally:
+                await runner.cleanup()
+
+        return asyncio.run(run())
+
+    def test_slots_are_sent_on_schedule(self):
+        schedule, sent = self.run_schedule(rate="100/s", workers=10, seconds=0.5, delay=0)
+        self.assertGreaterEqual(schedule.no_scheduled, 45)
+        self.assertLessEqual(schedule.no_scheduled, 51)
+        self.assertEqual(schedule.no_dropped, 0)
+        self.assertEqual(sent, schedule.no_scheduled)
+
+    def test_slots_finding_every_worker_busy_are_dropped(self):
+        schedule, sent = self.run_schedule(rate="100/s", workers=1, seconds=0.5, delay=0.2)
+        self.assertGreater(schedule.no_dropped, 0)
+        self.assertEqual(sent + schedule.no_dropped, schedule.no_scheduled)
+        self.assertLessEqual(sent, 3)
+
+    def test_slots_due_during_a_stall_are_late(self):
+        schedule, sent = self.run_schedule(rate="100/s", workers=50, seconds=0.5, delay=0, stall=0.1)
+        # The slots which came due while the loop was blocked are caught up on at once, all but the last late
+        self.assertGreaterEqual(schedule.no_late, 5)
+        self.assertEqual(schedule.no_dropped, 0)
+        self.assertEqual(sent, schedule.no_scheduled)
+
+
+if __name__ == "__main__":
+    unittest.main()
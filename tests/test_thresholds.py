@@ -0,0 +1,83 @@
+from tests.support import SECOND, make_result
+from webtop import (
+    ConnectionStats,
+    ResultAggregate,
+    RunStats,
+    breached_thresholds,
+    build_run_stats,
+    check_thresholds,
+    parse_args,
+)
+from typing import List
+import unittest
+
+
+class ThresholdsTest(unittest.TestCase):
+    def run_stats(
+        self, argv: List[str], *, no_successful: int, no_failed: int, elapsed_ns: int = 1_000_000
+    ) -> RunStats:
+        args = parse_args(["http://localhost/", *argv])
+        stats = build_run_stats(args, results=ResultAggregate(), connections=ConnectionStats())
+        # One result every 10ms, starting at 1s
+        for index in range(no_successful + no_failed):
+            status = 200 if index < no_successful else 503
+            stats.totals.add(make_result(timestamp=SECOND + index * 10_000_000, status=status, elapsed_ns=elapsed_ns))
+        return stats
+
+    def test_no_thresholds(self):
+        self.assertEqual(check_thresholds(parse_args(["http://localhost/"]), ResultAggregate()), {})
+
+    def test_checks_pass_and_fail(self):
+        argv = ["--max-error-rate", "5", "--max-p99", "10ms", "--min-rps", "50"]
+        stats = self.run_stats(argv, no_successful=96, no_failed=4, elapsed_ns=5_000_000)
+        checks = check_thresholds(parse_args(["http://localhost/", *argv]), stats.totals)
+        self.assertEqual(checks["Error Rate"]["Actual"], "4.000%")
+        self.assertTrue(checks["Error Rate"]["Passed"])
+        self.assertTrue(checks["p99 Latency"]["Passed"])
+        # 100 results 10ms apart span 0.99s
+        self.assertEqual(checks["Requests/sec"]["Actual"], "101.0")
+        self.assertTrue(checks["Requests/sec"]["Passed"])
+
+        argv = ["--max-error-rate", "3", "--max-p99", "1ms", "--min-rps", "200"]
+        checks = check_thresholds(parse_args(["http://localhost/", *argv]), stats.totals)
+        self.assertEqual([check["Passed"] for check in checks.values()], [False, False, False])
+
+    def test_no_results_pass_the_error_rate(self):
+        args = parse_args(["http://localhost/", "--max-error-rate", "0"])
+        self.assertTrue(check_thresholds(args, ResultAggregate())["Error Rate"]["Passed"])
+
+    def test_error_rate_breaches_once_remaining_requests_cannot_make_up_for_it(self):
+        argv = ["--max-error-rate", "10", "-d", "10s"]
+        args = parse_args(["http://localhost/", *argv])
+        stats = self.run_stats(argv, no_successful=50, no_failed=50)
+        # 100 requests a second for 9 more seconds could bring the error rate down to 5%
+        self.assertEqual(breached_thresholds(args, stats, elapsed=1.0, remaining=9.0), [])
+        # With 1 second to go it can only come down to 25%
+        (breach,) = breached_thresholds(args, stats, elapsed=9.0, remaining=1.0)
+        self.assertIn("Error rate will be at least", breach)
+
+    def test_p99_breaches_once_more_than_one_percent_are_slow(self):
+        argv = ["--max-p99", "10ms", "-d", "10s"]
+        args = parse_args(["http://localhost/", *argv])
+        stats = self.run_stats(argv, no_successful=100, no_failed=0, elapsed_ns=50_000_000)
+        self.assertEqual(
+            breached_thresholds(args, stats, elapsed=1.0, remaining=0.0), ["p99 latency will be above 10.000ms"]
+        )
+        # 10,000 more fast responses would bring the slow ones under 1%
+        self.assertEqual(breached_thresholds(args, stats, elapsed=1.0, remaining=100.0), [])
+
+    def test_rps_only_breaches_on_a_schedule(self):
+        argv = ["--min-rps", "100", "-d", "10s"]
+        stats = self.run_stats(argv, no_successful=10, no_failed=0)
+        self.assertEqual(
+            breached_thresholds(parse_args(["http://localhost/", *argv]), stats, elapsed=5.0, remaining=5.0), []
+        )
+
+        argv = [*argv, "--rate", "50/s"]
+        stats = self.run_stats(argv, no_successful=10, no_failed=0)
+        (breach,) = breached_thresholds(parse_args(["http://localhost/", *argv]), stats, elapsed=5.0, remaining=5.0)
+        self.assertEqual(breach, "Requests/sec will be at most 26.0, below 100")
+
+
+if __name__ == "__main__":
+    unittest.main()
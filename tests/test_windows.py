@@ -0,0 +1,57 @@
+from tests.support import SECOND, make_result
+from webtop import REASONS, TimeWindows
+import unittest
+
+
+class TimeWindowsTest(unittest.TestCase):
+    def test_windows_cover_completed_seconds(self):
+        windows = TimeWindows(lengths=(1, 3))
+        for second in range(5):
+            for _ in range(second + 1):
+                windows.add(make_result(timestamp=100 * SECOND + second * SECOND + SECOND // 2))
+        windows.advance(105 * SECOND)
+        # The last completed second had 5 results, the last three had 3 + 4 + 5
+        self.assertEqual(len(windows.windows[1]), 5)
+        self.assertEqual(len(windows.windows[3]), 12)
+        self.assertEqual(windows.windows[3].latency_histogram.total_count, 12)
+
+    def test_results_expire(self):
+        windows = TimeWindows(lengths=(1, 3))
+        windows.add(make_result(timestamp=100 * SECOND, status=503))
+        windows.advance(102 * SECOND)
+        self.assertEqual(len(windows.windows[3]), 1)
+        self.assertEqual(windows.windows[3].reason_counts, {REASONS.intern("HTTP 503"): 1})
+        windows.advance(104 * SECOND)
+        self.assertEqual(len(windows.windows[3]), 0)
+        self.assertEqual(windows.windows[3].reason_counts, {})
+        self.assertEqual(windows.windows[3].latency_histogram.counts, {})
+
+    def test_long_gaps_reset_the_windows(self):
+        windows = TimeWindows(lengths=(1, 3))
+        windows.add(make_result(timestamp=100 * SECOND))
+        windows.advance(200 * SECOND)
+        self.assertEqual(len(windows.windows[3]), 0)
+
+    def test_coverage_starts_at_the_first_result(self):
+        windows = TimeWindows(lengths=(1, 10))
+        windows.advance(100 * SECOND)
+        windows.add(make_result(timestamp=100 * SECOND + SECOND // 4 * 3))
+        windows.advance(102 * SECOND)
+        self.assertEqual(windows.covered(1), 1.0)
+        self.assertAlmostEqual(windows.covered(10), 1.25)
+
+    def test_merge_keeps_the_earliest_first_result(self):
+        first, second = TimeWindows(lengths=(10,)), TimeWindows(lengths=(10,))
+        first.add(make_result(timestamp=100 * SECOND + SECOND // 2))
+        second.add(make_result(timestamp=101 * SECOND))
+        first.advance(103 * SECOND)
+        second.advance(103 * SECOND)
+        merged = TimeWindows(lengths=(10,))
+        merged.merge(first)
+        merged.merge(second)
+        self.assertEqual(len(merged.windows[10]), 2)
+        self.assertAlmostEqual(merged.covered(10), 2.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,69 +1,475 @@
 #!/usr/bin/env python3
 
-from collections import deque
-from typing import Dict, Collection, Optional, Deque, List, Any, Callable
+from array import array
+from typing import (
+    Dict,
+    Collection,
+    Optional,
+    List,
+    Any,
+    Awaitable,
+    Callable,
+    Iterator,
+    Sequence,
+    Set,
+    Tuple,
+    TextIO,
+    Union,
+    BinaryIO,
+)
+from aiohttp import web
 from yarl import URL
+import abc
+import aiodns  # type: ignore
 import aiohttp
 import argparse
 import asyncio
-import datetime
+import contextvars
+import csv
+import ipaddress
+import itertools
 import durationpy  # type: ignore
+import importlib
+import io
 import json
 import math
+import mmap
+import multiprocessing
+import multiprocessing.connection
+import multiprocessing.synchronize
 import os
+import pickle
+import queue
+import random
+import re
+import shutil
 import signal
 import socket
+import struct
+import sys
+import tempfile
+import threading
 import time
+import weakref
 import yaml
+import zlib
 
 
 class CustomResolver(aiohttp.resolver.AbstractResolver):
     async def close(self) -> None:
         await self.async_resolver.close()
 
-    def __init__(self, *args, custom_mappings: Optional[Dict[str, str]] = None, **kwargs):
+    def __init__(
+        self,
+        *args,
+        custom_mappings: Optional[Dict[str, List[str]]] = None,
+        resolver: Optional[aiohttp.resolver.AbstractResolver] = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)  # type: ignore
         if custom_mappings is None:
-            self.custom_mappings: Dict[str, str] = {}
+            self.custom_mappings: Dict[str, List[str]] = {}
         else:
             self.custom_mappings = custom_mappings
-        self.async_resolver = aiohttp.resolver.AsyncResolver()  # type: ignore
+        # Number of times each mapping has been handed out, used to rotate through its addresses
+        self.uses: Dict[str, int] = {}
+        # Hosts without a custom mapping are resolved by resolver
+        if resolver is None:
+            self.async_resolver: aiohttp.resolver.AbstractResolver = aiohttp.resolver.AsyncResolver()  # type: ignore
+        else:
+            self.async_resolver = resolver
 
+    # Every address is returned, starting from a different one each time so that new connections are spread across them
     async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict[str, Any]]:
         if host in self.custom_mappings:
+            addresses = self.custom_mappings[host]
+            uses = self.uses.get(host, 0)
+            self.uses[host] = uses + 1
+            offset = uses % len(addresses)
             return [
                 {
                     "hostname": host,
-                    "host": self.custom_mappings[host],
+                    "host": address,
                     "port": port,
-                    "family": family,
+                    "family": socket.AF_INET6 if ":" in address else socket.AF_INET,
                     "proto": 0,
                     "flags": socket.AI_NUMERICHOST,
                 }
+                for address in addresses[offset:] + addresses[:offset]
             ]
         return await self.async_resolver.resolve(host, port, family)
 
 
-def parse_args() -> argparse.Namespace:
-    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+class ConnectionStats(object):
+    def __init__(self) -> None:
+        # no_ = Number Of
+        self.no_retired_connections = 0
+        self.no_dns_lookups = 0
+        self.no_dns_cache_hits = 0
+        # New connections which waited on a lookup already in progress for the same name
+        self.no_dns_shared_lookups = 0
+
+    def merge(self, other: "ConnectionStats") -> None:
+        self.no_retired_connections += other.no_retired_connections
+        self.no_dns_lookups += other.no_dns_lookups
+        self.no_dns_cache_hits += other.no_dns_cache_hits
+        self.no_dns_shared_lookups += other.no_dns_shared_lookups
+
+
+# Seconds to cache names whose addresses did not come from DNS records, such as names in /etc/hosts, which come without
+# a TTL
+DEFAULT_DNS_TTL = 10.0
+
+DNS_SPREADS = ("round-robin", "random")
+
+
+class DNSCacheEntry(object):
+    def __init__(self, *, addresses: List[Dict[str, Any]], expires: float):
+        self.addresses = addresses
+        # time.monotonic() at expiry
+        self.expires = expires
+        # Number of times the entry has been handed out, used to rotate through the addresses
+        self.uses = 0
+
+
+# Caches answers for as long as their TTL allows, or for a fixed TTL if one is given. Every lookup returns all of the
+# addresses for a name, rotated or shuffled so that new connections are spread across them rather than all going to the
+# first. aiohttp's own DNS cache must be disabled for this to see every new connection. Addresses always come from the
+# wrapped resolver, so /etc/hosts and search domains still apply; DNS is only queried directly for the TTLs
+class CachingResolver(aiohttp.resolver.AbstractResolver):
+    def __init__(
+        self,
+        *,
+        stats: ConnectionStats,
+        ttl: Optional[float] = None,
+        spread: str = "round-robin",
+        resolver: Optional[aiohttp.resolver.AbstractResolver] = None,
+    ):
+        self.stats = stats
+        self.ttl = ttl
+        self.spread = spread
+        if resolver is None:
+            self.resolver: aiohttp.resolver.AbstractResolver = aiohttp.resolver.AsyncResolver()  # type: ignore
+        else:
+            self.resolver = resolver
+        self.dns = aiodns.DNSResolver()
+        self.cache: Dict[Tuple[str, int], DNSCacheEntry] = {}
+        # Lookups in progress, which concurrent connections to the same name wait on rather than repeat
+        self.pending: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    async def close(self) -> None:
+        await self.resolver.close()
+
+    # Returns the addresses for host along with the number of seconds they can be cached for
+    async def _lookup(self, host: str, family: int) -> Tuple[List[Dict[str, Any]], float]:
+        addresses = await self.resolver.resolve(host, 0, family)  # type: ignore
+        if self.ttl is not None:
+            return addresses, self.ttl
+        return addresses, await self._ttl(host, family, {address["host"] for address in addresses})
+
+    # The smallest TTL of the DNS records behind addresses. Addresses which DNS did not give, such as those pinned in
+    # /etc/hosts, get DEFAULT_DNS_TTL
+    async def _ttl(self, host: str, family: int, addresses: Set[str]) -> float:
+        record_types = []
+        if family in (socket.AF_INET, socket.AF_UNSPEC):
+            record_types.append("A")
+        if family in (socket.AF_INET6, socket.AF_UNSPEC):
+            record_types.append("AAAA")
+        ttls: Dict[str, int] = {}
+        for record_type in record_types:
+            try:
+                records = await self.dns.query(host, record_type)
+            except aiodns.error.DNSError:
+                continue
+            for record in records:
+                ttls[record.host] = record.ttl
+        if not addresses <= ttls.keys():
+            return DEFAULT_DNS_TTL
+        return min(ttls[address] for address in addresses)
+
+    async def _refresh(self, host: str, family: int) -> DNSCacheEntry:
+        addresses, ttl = await self._lookup(host, family)
+        entry = DNSCacheEntry(addresses=addresses, expires=time.monotonic() + ttl)
+        if ttl > 0:
+            self.cache[(host, family)] = entry
+        return entry
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[Dict[str, Any]]:
+        key = (host, family)
+        cached = self.cache.get(key)
+        if cached is not None and cached.expires > time.monotonic():
+            self.stats.no_dns_cache_hits += 1
+            entry = cached
+        else:
+            pending = self.pending.get(key)
+            if pending is None:
+                self.stats.no_dns_lookups += 1
+                pending = self.pending[key] = asyncio.ensure_future(self._refresh(host, family))
+                pending.add_done_callback(lambda _: self.pending.pop(key, None))
+            else:
+                self.stats.no_dns_shared_lookups += 1
+            entry = await asyncio.shield(pending)
+
+        addresses = [dict(address, port=port) for address in entry.addresses]
+        if self.spread == "random":
+            random.shuffle(addresses)
+        else:
+            offset = entry.uses % len(addresses)
+            addresses = addresses[offset:] + addresses[:offset]
+        entry.uses += 1
+        return addresses
+
+
+# Keeps pooled connections from living forever so that keep-alive runs still exercise connection setup now and then,
+# the way long-lived clients do
+class PoolingConnector(aiohttp.TCPConnector):
+    def __init__(
+        self,
+        *args,
+        max_requests_per_connection: int = 0,
+        max_connection_age: float = 0.0,
+        split_tls: bool = True,
+        stats: Optional[ConnectionStats] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.split_tls = split_tls
+        self.max_requests_per_connection = max_requests_per_connection
+        self.max_connection_age = max_connection_age
+        self.connection_requests: "weakref.WeakKeyDictionary[Any, int]" = weakref.WeakKeyDictionary()
+        self.connection_created: "weakref.WeakKeyDictionary[Any, float]" = weakref.WeakKeyDictionary()
+        self.stats = stats if stats is not None else ConnectionStats()
+
+    async def _create_connection(self, *args, **kwargs):  # type: ignore
+        protocol = await super()._create_connection(*args, **kwargs)  # type: ignore
+        self.connection_created[protocol] = time.monotonic()
+        return protocol
+
+    async def _wrap_create_connection(self, protocol_factory, *args, **kwargs):  # type: ignore
+        trace = CURRENT_TRACE.get(None)
+        if trace is None or not self.split_tls:
+            return await super()._wrap_create_connection(protocol_factory, *args, **kwargs)  # type: ignore
+
+        # The asyncio event loop builds the protocol once the TCP connection is up, before any TLS handshake starts, which
+        # lets us split connection setup into its TCP and TLS parts. uvloop builds it before connecting, so with uvloop
+        # the TLS handshake is counted as part of Connect
+        def traced_protocol_factory():  # type: ignore
+            trace.tcp_connected = time.perf_counter_ns()
+            trace.tls = kwargs.get("ssl") is not None
+            return protocol_factory()
+
+        return await super()._wrap_create_connection(traced_protocol_factory, *args, **kwargs)  # type: ignore
+
+    # Records which address each request was sent to, whether its connection is new or pooled
+    async def connect(self, *args, **kwargs):  # type: ignore
+        connection = await super().connect(*args, **kwargs)  # type: ignore
+        trace = CURRENT_TRACE.get(None)
+        if trace is not None and connection.transport is not None:
+            peername = connection.transport.get_extra_info("peername")
+            if peername:
+                trace.peer = peername[0]
+        return connection
+
+    def _should_retire(self, protocol: Any, requests: int) -> bool:
+        if self.max_requests_per_connection and requests >= self.max_requests_per_connection:
+            return True
+        age = time.monotonic() - self.connection_created.get(protocol, 0.0)
+        return bool(self.max_connection_age) and age >= self.max_connection_age
+
+    def _release(self, key, protocol, *, should_close=False):  # type: ignore
+        requests = self.connection_requests.get(protocol, 0) + 1
+        self.connection_requests[protocol] = requests
+        if not should_close and self._should_retire(protocol, requests):
+            should_close = True
+            self.stats.no_retired_connections += 1
+        super()._release(key, protocol, should_close=should_close)  # type: ignore
+
+
+PHASES = ("DNS", "Connect", "TLS", "TTFB", "Body")
+NO_PHASES = (-1,) * len(PHASES)
+BODY_PHASE = PHASES.index("Body")
+
+
+def _span_ns(start: Optional[int], end: Optional[int]) -> int:
+    if start is None or end is None:
+        return -1
+    return max(end - start, 0)
+
+
+# Per-request time.perf_counter_ns() timestamps filled in by aiohttp's tracing hooks
+class RequestTrace(object):
+    __slots__ = (
+        "new_connection",
+        "tls",
+        "dns_start",
+        "dns_end",
+        "connect_start",
+        "tcp_connected",
+        "connect_end",
+        "connection_ready",
+        "headers_received",
+        "peer",
+    )
+
+    def __init__(self) -> None:
+        self.new_connection = False
+        self.tls = False
+        self.dns_start: Optional[int] = None
+        self.dns_end: Optional[int] = None
+        self.connect_start: Optional[int] = None
+        self.tcp_connected: Optional[int] = None
+        self.connect_end: Optional[int] = None
+        self.connection_ready: Optional[int] = None
+        self.headers_received: Optional[int] = None
+        # Address of the server the request was sent to
+        self.peer = ""
+
+    # Nanoseconds spent in each of PHASES, or -1 for phases the request did not go through
+    def phases_ns(self, end_time: int) -> Tuple[int, ...]:
+        if self.connect_end is not None:
+            # Name resolution happens within connection setup
+            connect_start = self.dns_end if self.dns_end is not None else self.connect_start
+            if self.tcp_connected is not None:
+                connect = _span_ns(connect_start, self.tcp_connected)
+            else:
+                connect = _span_ns(connect_start, self.connect_end)
+        else:
+            connect = -1
+        if self.tls:
+            tls = _span_ns(self.tcp_connected, self.connect_end)
+        else:
+            tls = -1
+        return (
+            _span_ns(self.dns_start, self.dns_end),
+            connect,
+            tls,
+            _span_ns(self.connection_ready, self.headers_received),
+            _span_ns(self.headers_received, end_time),
+        )
+
+
+# aiohttp does not pass trace contexts to the connector, so the trace of the request being sent is also made available
+# through a context variable
+CURRENT_TRACE: "contextvars.ContextVar[RequestTrace]" = contextvars.ContextVar("CURRENT_TRACE")
+
+
+def build_trace_config() -> aiohttp.TraceConfig:
+    async def on_dns_resolvehost_start(_, context, __) -> None:
+        context.trace_request_ctx.dns_start = time.perf_counter_ns()
+
+    async def on_dns_resolvehost_end(_, context, __) -> None:
+        context.trace_request_ctx.dns_end = time.perf_counter_ns()
+
+    async def on_connection_create_start(_, context, __) -> None:
+        trace = context.trace_request_ctx
+        trace.connect_start = time.perf_counter_ns()
+        trace.dns_start = trace.dns_end = trace.tcp_connected = None
+
+    async def on_connection_create_end(_, context, __) -> None:
+        trace = context.trace_request_ctx
+        trace.new_connection = True
+        trace.connect_end = trace.connection_ready = time.perf_counter_ns()
+
+    async def on_connection_reuseconn(_, context, __) -> None:
+        context.trace_request_ctx.connection_ready = time.perf_counter_ns()
+
+    # aiohttp signals the end of a request once the response headers have been read
+    async def on_request_end(_, context, __) -> None:
+        context.trace_request_ctx.headers_received = time.perf_counter_ns()
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
 
-    parser.add_argument("url", metavar="URL", type=URL)
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=f"Other commands: {', '.join(COMMANDS)}. Run webtop COMMAND --help for their options",
+    )
+
+    parser.add_argument("url", metavar="URL", type=URL, nargs="?", help="URL to request, unless --scenario is given")
+
+    parser.add_argument(
+        "--scenario",
+        metavar="FILE",
+        type=load_scenario,
+        help="YAML file listing weighted requests to send instead of URL",
+        default=None,
+    )
 
     parser.add_argument(
         "--method",
         metavar="VERB",
         help="HTTP method",
         type=str.upper,
-        choices=["GET", "HEAD", "OPTIONS", "TRACE"],
+        choices=HTTP_METHODS,
         default="GET",
     )
 
-    parser.add_argument("-k", "--workers", metavar="N", type=int, help="Number of workers", default=1)
+    body = parser.add_mutually_exclusive_group()
+    body.add_argument(
+        "--body",
+        metavar="BODY",
+        type=load_body,
+        help="Request body, or @FILE to send the contents of FILE",
+        default=None,
+    )
+    body.add_argument(
+        "--body-template",
+        metavar="TEMPLATE",
+        type=load_body_template,
+        help="Request body rendered for each request, or @FILE to read the template from FILE. "
+        "${counter} is replaced with a request counter, unique across --processes, and ${random} with a random number",
+        default=None,
+    )
+
+    parser.add_argument(
+        "-k",
+        "--workers",
+        metavar="N",
+        type=int,
+        help="Number of workers. With --rate, the maximum number of requests in flight",
+        default=1,
+    )
+
+    parser.add_argument(
+        "-p",
+        "--processes",
+        metavar="N",
+        type=int,
+        help="Number of processes to spread workers and --rate across, to use more than one CPU core",
+        default=1,
+    )
+
+    parser.add_argument(
+        "--rate",
+        metavar="N/s",
+        type=str,
+        help=(
+            "Send requests on a fixed schedule at this rate (e.g. 100/s, 600/m) regardless of how fast responses"
+            " arrive. Latency is measured from the scheduled send time"
+        ),
+        default=None,
+    )
 
     parser.add_argument(
         "--request-history", metavar="N", type=int, help="Number of request results to track", default=1000
     )
 
+    parser.add_argument(
+        "--latency-significant-digits",
+        metavar="N",
+        type=int,
+        help="Precision of latency percentiles, in significant decimal digits",
+        default=3,
+    )
+
     parser.add_argument("--timeout", metavar="SEC", type=float, help="Request timeout threshold", default=1.0)
 
     parser.add_argument(
@@ -74,10 +480,56 @@ def parse_args() -> argparse.Namespace:
         default="true",
     )
 
+    parser.add_argument(
+        "--body-mode",
+        metavar="MODE",
+        type=str,
+        choices=("read", "discard"),
+        help="Whether to read response bodies into memory, or discard them as they arrive",
+        default="read",
+    )
+
+    parser.add_argument(
+        "--body-checksum",
+        metavar="ALGORITHM",
+        type=str,
+        choices=("none", *BODY_CHECKSUMS),
+        help="Checksum response bodies and count bodies which differ from the first body seen with the same status",
+        default="none",
+    )
+
     parser.add_argument(
         "--verify-tls", metavar="BOOL", type=str, help="Whether to verify TLS certificates", default="true"
     )
 
+    parser.add_argument(
+        "--keepalive",
+        metavar="BOOL",
+        type=str,
+        help="Whether to reuse connections across requests instead of opening a new connection for each request",
+        default="false",
+    )
+
+    parser.add_argument(
+        "--max-connections", metavar="N", type=int, help="Maximum number of open connections, 0 for no limit", default=0
+    )
+
+    parser.add_argument(
+        "--max-requests-per-connection",
+        metavar="N",
+        type=int,
+        help="With --keepalive, close connections after this many requests, 0 for no limit",
+        default=0,
+    )
+
+    parser.add_argument(
+        "--connection-max-age",
+        metavar="SEC",
+        type=float,
+        help="With --keepalive, close connections once they are this old, 0 for no limit",
+        default=0.0,
+    )
+
     parser.add_argument(
         "-o",
         "--output-format",
@@ -88,11 +540,130 @@ def parse_args() -> argparse.Namespace:
         default="json",
     )
 
-    parser.add_argument("--resolve", metavar="HOST:ADDRESS", type=str, help="Manually resolve host to address")
+    parser.add_argument(
+        "--resolve",
+        metavar="HOST:ADDRESS[,ADDRESS...]",
+        type=str,
+        action="append",
+        help="Manually resolve host to one or more addresses, spreading connections across them. May be repeated",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--dns-cache-ttl",
+        metavar="TIME",
+        type=str,
+        help="Cache DNS answers for this long instead of for their TTL. 0s disables caching",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--dns-spread",
+        metavar="SPREAD",
+        type=str,
+        choices=DNS_SPREADS,
+        help="How new connections are spread across the addresses a name resolves to",
+        default="round-robin",
+    )
+
+    parser.add_argument(
+        "--log-results",
+        metavar="FILE",
+        type=str,
+        help="Append a record of every request to FILE",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--log-format",
+        metavar="FORMAT",
+        type=str,
+        choices=LOG_FORMATS,
+        help="Format of --log-results records",
+        default="jsonl",
+    )
+
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        type=str,
+        help="Record every request to FILE in a compact binary format, for webtop analyze. "
+        "With --processes, each process records to FILE.N",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--headless",
+        metavar="BOOL",
+        type=str,
+        help="Whether to print a JSON line of stats for each --report-interval instead of redrawing the terminal",
+        default="false",
+    )
+
+    parser.add_argument(
+        "--report-interval",
+        metavar="TIME",
+        type=str,
+        help="How often to print stats with --headless",
+        default="1s",
+    )
+
+    parser.add_argument(
+        "--metrics-listen",
+        metavar="HOST:PORT",
+        type=str,
+        help="Serve run statistics in the Prometheus text format at http://HOST:PORT/metrics",
+        default=None,
+    )
 
     parser.add_argument("-d", "--duration", metavar="TIME", type=str, help="Test duration, e.g. 3h2m1s", default=None)
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--max-error-rate",
+        metavar="PERCENT",
+        type=float,
+        help="Exit with status 1 if more than this percentage of all requests failed",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--max-p99",
+        metavar="TIME",
+        type=str,
+        help="Exit with status 1 if the p99 latency of all responses is above this, e.g. 250ms",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--min-rps",
+        metavar="N",
+        type=float,
+        help="Exit with status 1 if fewer than this many requests were sent per second",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--abort-on-breach",
+        metavar="BOOL",
+        type=str,
+        help="Whether to end the test as soon as a threshold can no longer be met. Requires --duration",
+        default="false",
+    )
+
+    parser.add_argument(
+        "--loop",
+        metavar="LOOP",
+        type=str,
+        choices=EVENT_LOOPS,
+        help="Event loop implementation. Falls back to asyncio when uvloop is not installed",
+        default="asyncio",
+    )
+
+    args = parser.parse_args(argv)
+    args.argv = list(argv) if argv is not None else sys.argv[1:]
+    # Which of --processes this is, set for each load process by load_process_args()
+    args.process_index = 0
+    return args
 
 
 def duration_is_valid(duration: Optional[str]) -> bool:
@@ -106,6 +677,250 @@ def duration_is_valid(duration: Optional[str]) -> bool:
         return False
 
 
+RATE_UNITS = {"s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_rate(rate: str) -> float:
+    count, _, unit = rate.partition("/")
+    return float(count) / RATE_UNITS[unit or "s"]
+
+
+def rate_is_valid(rate: Optional[str]) -> bool:
+    if rate is None:
+        return True
+    try:
+        return parse_rate(rate) > 0
+    except (KeyError, ValueError):
+        return False
+
+
+# Maps each host given to --resolve to its addresses. IPv6 addresses may be given with or without brackets
+def parse_resolve(mappings: Optional[Sequence[str]]) -> Dict[str, List[str]]:
+    custom_mappings: Dict[str, List[str]] = {}
+    for mapping in mappings or ():
+        host, addresses = mapping.split(":", 1)
+        for address in addresses.split(","):
+            address = address.strip().strip("[]")
+            ipaddress.ip_address(address)
+            custom_mappings.setdefault(host, []).append(address)
+    return custom_mappings
+
+
+def resolve_is_valid(mappings: Optional[Sequence[str]]) -> bool:
+    try:
+        parse_resolve(mappings)
+        return True
+    except ValueError:
+        return False
+
+
+HTTP_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE", "POST", "PUT", "PATCH", "DELETE")
+
+# Files larger than this are memory-mapped rather than read in
+BODY_MMAP_THRESHOLD = 1024 * 1024
+
+Body = Union[bytes, memoryview]
+
+
+# Reads a body file once, so that every request sends the same buffer
+def read_body_file(path: str) -> Body:
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        if size < BODY_MMAP_THRESHOLD:
+            f.seek(0)
+            return f.read()
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def load_body(value: str) -> Body:
+    if not value.startswith("@"):
+        return value.encode()
+    try:
+        return read_body_file(value[1:])
+    except OSError as e:
+        raise argparse.ArgumentTypeError(f"cannot read body from {value[1:]}: {e}")
+
+
+TEMPLATE_FIELD = re.compile(r"\$(?:(\$)|\{(\w+)\})")
+TEMPLATE_FIELDS = ("counter", "random")
+
+
+# A body template split up front into encoded literal text and the fields between it, so rendering a body is a join
+class BodyTemplate(object):
+    def __init__(self, template: str):
+        self.parts: List[Tuple[bytes, str]] = []
+        literal = ""
+        position = 0
+        for match in TEMPLATE_FIELD.finditer(template):
+            start = match.start()
+            literal += template[position:start]
+            position = match.end()
+            # $$ is an escaped $
+            if match.group(1) is not None:
+                literal += "$"
+                continue
+            field = match.group(2)
+            if field not in TEMPLATE_FIELDS:
+                raise ValueError(f"unknown field ${{{field}}}, expected one of {', '.join(TEMPLATE_FIELDS)}")
+            self.parts.append((literal.encode(), field))
+            literal = ""
+        self.tail = (literal + template[position:]).encode()
+        self.random = random.Random()
+
+    def render(self, counter: int) -> bytes:
+        chunks = []
+        for literal, field in self.parts:
+            chunks.append(literal)
+            if field == "counter":
+                chunks.append(str(counter).encode())
+            else:
+                chunks.append(str(self.random.getrandbits(32)).encode())
+        chunks.append(self.tail)
+        return b"".join(chunks)
+
+
+def load_body_template(value: str) -> BodyTemplate:
+    try:
+        if value.startswith("@"):
+            with open(value[1:]) as f:
+                value = f.read()
+        return BodyTemplate(value)
+    except (OSError, ValueError) as e:
+        raise argparse.ArgumentTypeError(f"invalid body template: {e}")
+
+
+class ScenarioEntry(object):
+    def __init__(
+        self,
+        *,
+        url: URL,
+        method: str = "GET",
+        headers: Optional[Dict[str, str]] = None,
+        body: Optional[Body] = None,
+        body_template: Optional[BodyTemplate] = None,
+        weight: float = 1.0,
+        name: Optional[str] = None,
+    ):
+        self.url = url
+        self.method = method
+        self.headers = headers
+        self.body = body
+        self.body_template = body_template
+        self.weight = weight
+        self.name = name if name is not None else f"{method} {url}"
+
+
+# Walker's alias method: each slot holds an entry and an alias, and an entry is picked with one uniform slot choice and
+# one biased coin flip however many entries there are
+def build_alias_table(weights: Sequence[float]) -> Tuple[List[float], List[int]]:
+    no_entries = len(weights)
+    total = sum(weights)
+    scaled = [weight * no_entries / total for weight in weights]
+    probabilities = [1.0] * no_entries
+    aliases = list(range(no_entries))
+    small = [index for index, weight in enumerate(scaled) if weight < 1.0]
+    large = [index for index, weight in enumerate(scaled) if weight >= 1.0]
+    while small and large:
+        lesser = small.pop()
+        greater = large.pop()
+        probabilities[lesser] = scaled[lesser]
+        aliases[lesser] = greater
+        scaled[greater] += scaled[lesser] - 1.0
+        if scaled[greater] < 1.0:
+            small.append(greater)
+        else:
+            large.append(greater)
+    return probabilities, aliases
+
+
+# The requests to send, and how often to send each of them relative to the others
+class Scenario(object):
+    def __init__(self, *, entries: Sequence[ScenarioEntry], path: Optional[str] = None):
+        self.entries = list(entries)
+        self.path = path
+        self.probabilities, self.aliases = build_alias_table([entry.weight for entry in self.entries])
+        self.random = random.Random()
+
+    # Returns the index of the entry to send next
+    def pick(self) -> int:
+        slot = int(self.random.random() * len(self.entries))
+        if self.random.random() < self.probabilities[slot]:
+            return slot
+        return self.aliases[slot]
+
+
+def _scenario_entry(entry: Any) -> ScenarioEntry:
+    if not isinstance(entry, dict) or "url" not in entry:
+        raise ValueError("every entry needs a url")
+    url = URL(str(entry["url"]))
+    if not url.is_absolute():
+        raise ValueError(f"{url} is not an absolute URL")
+    method = str(entry.get("method", "GET")).upper()
+    if method not in HTTP_METHODS:
+        raise ValueError(f"{method} is not one of {', '.join(HTTP_METHODS)}")
+    weight = float(entry.get("weight", 1.0))
+    if weight <= 0:
+        raise ValueError("weights must be positive")
+    headers = entry.get("headers")
+    if headers is not None:
+        if not isinstance(headers, dict):
+            raise ValueError("headers must be a mapping")
+        headers = {str(name): str(value) for name, value in headers.items()}
+    body: Optional[Body] = None
+    if "body" in entry:
+        body = str(entry["body"]).encode()
+    elif "body_file" in entry:
+        body = read_body_file(str(entry["body_file"]))
+    body_template = None
+    if "body_template" in entry:
+        body_template = BodyTemplate(str(entry["body_template"]))
+    name = entry.get("name")
+    return ScenarioEntry(
+        url=url,
+        method=method,
+        headers=headers,
+        body=body,
+        body_template=body_template,
+        weight=weight,
+        name=str(name) if name is not None else None,
+    )
+
+
+# Reads a scenario file, which holds a list of entries like:
+#
+#   - name: search
+#     url: https://example.com/search?q=webtop
+#     method: POST
+#     weight: 3
+#     headers:
+#       Content-Type: application/json
+#     body_template: '{"query": "webtop", "page": ${counter}}'
+#
+# Bodies can be given inline with body, read from a file with body_file, or rendered for each request with body_template
+def load_scenario(path: str) -> Scenario:
+    try:
+        with open(path) as f:
+            document = yaml.safe_load(f)
+        if not isinstance(document, list) or not document:
+            raise ValueError("expected a list of requests")
+        entries = [_scenario_entry(entry) for entry in document]
+    except (OSError, yaml.YAMLError, ValueError, TypeError) as e:
+        raise argparse.ArgumentTypeError(f"invalid scenario {path}: {e}")
+    names = [entry.name for entry in entries]
+    if len(set(names)) != len(names):
+        raise argparse.ArgumentTypeError(f"invalid scenario {path}: entry names must be unique")
+    return Scenario(entries=entries, path=path)
+
+
+# Without --scenario, every request is for URL
+def build_scenario(args: argparse.Namespace) -> Scenario:
+    if args.scenario is not None:
+        return args.scenario
+    return Scenario(
+        entries=[ScenarioEntry(url=args.url, method=args.method, body=args.body, body_template=args.body_template)]
+    )
+
+
 def _str_to_bool(s: str, default: bool) -> bool:
     if s.lower() == "true":
         return True
@@ -117,103 +932,1262 @@ def _str_to_bool(s: str, default: bool) -> bool:
 def are_args_valid(args: argparse.Namespace) -> bool:
     return all(
         (
-            args.url.is_absolute(),
+            (args.url is None) != (args.scenario is None),
+            args.scenario is None or (args.body is None and args.body_template is None),
+            args.url is None or args.url.is_absolute(),
             args.request_history >= 1,
+            1 <= args.latency_significant_digits <= 5,
             args.timeout > 0,
             args.workers > 0,
-            args.resolve is None or ":" in args.resolve,
+            args.processes > 0,
+            args.workers >= args.processes,
+            args.max_connections >= 0,
+            args.max_connections == 0 or args.max_connections >= args.processes,
+            args.max_requests_per_connection >= 0,
+            args.connection_max_age >= 0,
+            resolve_is_valid(args.resolve),
             duration_is_valid(args.duration),
+            duration_is_valid(args.dns_cache_ttl),
+            duration_is_valid(args.max_p99),
+            duration_is_valid(args.report_interval) and parse_latency(args.report_interval) > 0,
+            args.max_error_rate is None or 0 <= args.max_error_rate <= 100,
+            args.min_rps is None or args.min_rps >= 0,
+            args.duration is not None or not _str_to_bool(args.abort_on_breach, default=False),
+            rate_is_valid(args.rate),
+            listen_address_is_valid(args.metrics_listen),
         )
     )
 
 
+# Interns strings such as failure reasons so that results only need to carry a small integer id. Once limit names have
+# been interned, any further names share the id of overflow
+class InternTable(object):
+    def __init__(self, *, limit: Optional[int] = None, overflow: str = "Other") -> None:
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.limit = limit
+        self.overflow = overflow
+
+    def intern(self, name: str) -> int:
+        try:
+            return self.ids[name]
+        except KeyError:
+            if self.limit is not None and len(self.names) >= self.limit:
+                if self.overflow in self.ids:
+                    return self.ids[self.overflow]
+                name = self.overflow
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+            return self.ids[name]
+
+    def name(self, _id: int) -> str:
+        return self.names[_id]
+
+
+# Every reason gets its own latency histogram, so the number of distinct reasons is capped
+MAX_REASONS = 64
+
+REASONS = InternTable(limit=MAX_REASONS)
+
+# Addresses of the servers which requests were sent to. Id 0 is for requests which never reached a server
+MAX_BACKENDS = 256
+
+BACKENDS = InternTable(limit=MAX_BACKENDS)
+NO_BACKEND = BACKENDS.intern("")
+
+
+# aiohttp uses very generic errors, so we need to drill down to the underlying error
+def underlying_error(error: BaseException) -> BaseException:
+    if isinstance(error, aiohttp.ClientConnectorError) and hasattr(error, "os_error"):
+        error = error.os_error
+    if isinstance(error, aiohttp.ClientConnectorCertificateError) and hasattr(error, "certificate_error"):
+        error = error.certificate_error
+    return error
+
+
+def error_reason(error: BaseException) -> str:
+    error = underlying_error(error)
+    reason = ""
+    error_module = type(error).__module__
+    if error_module and error_module != "builtins":
+        reason += f"{error_module}."
+    reason += type(error).__qualname__
+    return reason
+
+
+# Reasons only depend on the type of the underlying error, so each type is only classified once
+REASON_IDS_BY_TYPE: Dict[type, int] = {}
+
+
+def error_reason_id(error: BaseException) -> int:
+    error_type = type(underlying_error(error))
+    try:
+        return REASON_IDS_BY_TYPE[error_type]
+    except KeyError:
+        reason_id = REASON_IDS_BY_TYPE[error_type] = REASONS.intern(error_reason(error))
+        return reason_id
+
+
+REASON_IDS_BY_STATUS: Dict[int, int] = {}
+
+
+def status_reason_id(status: int) -> int:
+    try:
+        return REASON_IDS_BY_STATUS[status]
+    except KeyError:
+        reason_id = REASON_IDS_BY_STATUS[status] = REASONS.intern(f"HTTP {status}")
+        return reason_id
+
+
+# Results are reduced to a handful of integers as soon as a request completes, so that neither the response nor the
+# exception (and its traceback) outlive the request
 class Result(object):
-    def __init__(self, *, response: Optional[aiohttp.ClientResponse] = None, error: Optional[Exception] = None):
-        self.response = response
-        self.error = error
-        if self.response is None or self.error is not None:
-            self.is_success = False
-        else:
-            self.is_success = 200 <= self.response.status < 400
+    __slots__ = (
+        "status",
+        "reason_id",
+        "elapsed_ns",
+        "response_bytes",
+        "request_bytes",
+        "timestamp",
+        "new_connection",
+        "phases_ns",
+        "checksum",
+        "checksum_mismatch",
+        "backend_id",
+        "scenario_id",
+    )
+
+    def __init__(
+        self,
+        *,
+        status: int,
+        reason_id: int,
+        elapsed_ns: int,
+        response_bytes: int,
+        timestamp: int,
+        request_bytes: int = 0,
+        new_connection: bool = False,
+        phases_ns: Tuple[int, ...] = NO_PHASES,
+        checksum: int = -1,
+        checksum_mismatch: bool = False,
+        backend_id: int = NO_BACKEND,
+        scenario_id: int = 0,
+    ):
+        # status is 0 when no response was received
+        self.status = status
+        self.reason_id = reason_id
+        self.elapsed_ns = elapsed_ns
+        self.response_bytes = response_bytes
+        self.request_bytes = request_bytes
+        # time.perf_counter_ns() at completion
+        self.timestamp = timestamp
+        self.new_connection = new_connection
+        self.phases_ns = phases_ns
+        # -1 when bodies are not checksummed
+        self.checksum = checksum
+        self.checksum_mismatch = checksum_mismatch
+        self.backend_id = backend_id
+        # Index of the scenario entry which was sent
+        self.scenario_id = scenario_id
+
+    @property
+    def is_response(self) -> bool:
+        return self.status != 0
+
+    @property
+    def is_success(self) -> bool:
+        return 200 <= self.status < 400
+
+    @property
+    def reason(self) -> str:
+        return REASONS.name(self.reason_id)
+
+
+# Size on the wire of the request which produced a response: the request line, headers and body
+def request_size(request_info: aiohttp.RequestInfo, body_bytes: int = 0) -> int:
+    size = len(request_info.method) + len(request_info.url.raw_path_qs) + len(" HTTP/1.1\r\n") + 1
+    for name, value in request_info.headers.items():
+        size += len(name) + len(value) + len(": \r\n")
+    return size + len("\r\n") + body_bytes
+
+
+# The first checksum seen for each scenario entry and status code, which later bodies from the same entry with the same
+# status are expected to match
+REFERENCE_CHECKSUMS: Dict[Tuple[int, int], int] = {}
 
 
 class ResponseResult(Result):
-    def __init__(self, *, response: aiohttp.ClientResponse, duration: datetime.timedelta):
-        super().__init__(response=response, error=None)
-        self.elapsed = duration
+    __slots__ = ()
+
+    def __init__(
+        self,
+        *,
+        response: aiohttp.ClientResponse,
+        elapsed_ns: int,
+        response_bytes: int,
+        trace: Optional[RequestTrace] = None,
+        checksum: int = -1,
+        request_body_bytes: int = 0,
+        scenario_id: int = 0,
+    ):
+        timestamp = time.perf_counter_ns()
+        key = (scenario_id, response.status)
+        checksum_mismatch = checksum >= 0 and REFERENCE_CHECKSUMS.setdefault(key, checksum) != checksum
+        super().__init__(
+            status=response.status,
+            reason_id=status_reason_id(response.status),
+            elapsed_ns=elapsed_ns,
+            response_bytes=response_bytes,
+            request_bytes=request_size(response.request_info, request_body_bytes),
+            timestamp=timestamp,
+            new_connection=trace is not None and trace.new_connection,
+            phases_ns=trace.phases_ns(timestamp) if trace is not None else NO_PHASES,
+            checksum=checksum,
+            checksum_mismatch=checksum_mismatch,
+            backend_id=BACKENDS.intern(trace.peer) if trace is not None else NO_BACKEND,
+            scenario_id=scenario_id,
+        )
 
 
 class ErrorResult(Result):
-    def __init__(self, *, error: Exception):
-        super().__init__(response=None, error=error)
+    __slots__ = ()
+
+    def __init__(
+        self,
+        *,
+        error: BaseException,
+        elapsed_ns: int = 0,
+        trace: Optional[RequestTrace] = None,
+        scenario_id: int = 0,
+    ):
+        super().__init__(
+            status=0,
+            reason_id=error_reason_id(error),
+            # Time to failure
+            elapsed_ns=elapsed_ns,
+            response_bytes=0,
+            timestamp=time.perf_counter_ns(),
+            new_connection=trace is not None and trace.new_connection,
+            backend_id=BACKENDS.intern(trace.peer) if trace is not None else NO_BACKEND,
+            scenario_id=scenario_id,
+        )
+
+
+# Checksum functions and their initial values
+BODY_CHECKSUMS = {"crc32": (zlib.crc32, 0), "adler32": (zlib.adler32, 1)}
+
+
+# Reads a response body, returning its size and checksum (-1 without one). In "discard" mode the body is consumed as
+# it arrives without ever being held in full
+async def read_body(response: aiohttp.ClientResponse, *, mode: str = "read", checksum: str = "none") -> Tuple[int, int]:
+    if checksum in BODY_CHECKSUMS:
+        checksum_function, value = BODY_CHECKSUMS[checksum]
+    else:
+        checksum_function, value = None, -1
+
+    if mode == "read":
+        body = await response.read()
+        if checksum_function is not None:
+            value = checksum_function(body, value)
+        return len(body), value
+
+    size = 0
+    while True:
+        # readany() hands over chunks already in aiohttp's buffer without copying them
+        chunk = await response.content.readany()
+        if not chunk:
+            return size, value
+        size += len(chunk)
+        if checksum_function is not None:
+            value = checksum_function(chunk, value)
 
 
 async def request(
-    *, url: URL, method: str = "GET", follow_redirects: bool = True, session: aiohttp.ClientSession
+    *,
+    url: URL,
+    method: str = "GET",
+    headers: Optional[Dict[str, str]] = None,
+    data: Optional[Body] = None,
+    follow_redirects: bool = True,
+    session: aiohttp.ClientSession,
+    start_time: Optional[int] = None,
+    body_mode: str = "read",
+    body_checksum: str = "none",
+    scenario_id: int = 0,
 ) -> Result:
+    trace = RequestTrace()
+    CURRENT_TRACE.set(trace)
+    # When requests are sent on a schedule, latency is measured from when the request should have been sent
+    if start_time is None:
+        start_time = time.perf_counter_ns()
     try:
-        start_time = time.time()
-        async with session.request(method, url, allow_redirects=follow_redirects) as response:
-            await response.read()
-            end_time = time.time()
-            duration = datetime.timedelta(seconds=end_time - start_time)
-            return ResponseResult(response=response, duration=duration)
+        async with session.request(
+            method, url, headers=headers, data=data, allow_redirects=follow_redirects, trace_request_ctx=trace
+        ) as response:
+            response_bytes, checksum = await read_body(response, mode=body_mode, checksum=body_checksum)
+            elapsed_ns = time.perf_counter_ns() - start_time
+            return ResponseResult(
+                response=response,
+                elapsed_ns=elapsed_ns,
+                response_bytes=response_bytes,
+                trace=trace,
+                checksum=checksum,
+                request_body_bytes=len(data) if data is not None else 0,
+                scenario_id=scenario_id,
+            )
     except Exception as e:
-        return ErrorResult(error=e)
+        return ErrorResult(
+            error=e, elapsed_ns=time.perf_counter_ns() - start_time, trace=trace, scenario_id=scenario_id
+        )
 
 
-def build_stats(*, url: URL, method: str, results: Collection[Result]) -> dict:
-    # no_ = Number Of
-    no_results = len(results)
-    no_successful_results = 0
-    no_responses = 0
-    reason_counts: Dict[str, int] = {}
-    sum_latency = 0
+# Log-bucketed histogram in the style of HdrHistogram. Values are grouped into buckets whose width grows with their
+# magnitude so that every recorded value is reproduced to within the configured number of significant decimal digits.
+# Counts are only kept for buckets which have been used, and histograms with the same configuration can be merged.
+class Histogram(object):
+    def __init__(self, *, significant_digits: int = 3, highest_trackable_value: int = 3_600_000_000_000):
+        if not 1 <= significant_digits <= 5:
+            raise ValueError("significant_digits must be between 1 and 5")
+        self.significant_digits = significant_digits
+        self.highest_trackable_value = highest_trackable_value
+        self.sub_bucket_count_magnitude = math.ceil(math.log2(2 * 10**significant_digits))
+        self.sub_bucket_half_count_magnitude = self.sub_bucket_count_magnitude - 1
+        self.sub_bucket_half_count = 1 << self.sub_bucket_half_count_magnitude
+        self.sub_bucket_mask = (1 << self.sub_bucket_count_magnitude) - 1
+        self.counts: Dict[int, int] = {}
+        self.total_count = 0
+
+    def _index_of(self, value: int) -> int:
+        value = min(max(value, 0), self.highest_trackable_value)
+        bucket_index = (value | self.sub_bucket_mask).bit_length() - self.sub_bucket_count_magnitude
+        sub_bucket_index = value >> bucket_index
+        return (
+            ((bucket_index + 1) << self.sub_bucket_half_count_magnitude) + sub_bucket_index - self.sub_bucket_half_count
+        )
+
+    def _lowest_equivalent_value(self, index: int) -> int:
+        bucket_index = (index >> self.sub_bucket_half_count_magnitude) - 1
+        sub_bucket_index = (index & (self.sub_bucket_half_count - 1)) + self.sub_bucket_half_count
+        if bucket_index < 0:
+            sub_bucket_index -= self.sub_bucket_half_count
+            bucket_index = 0
+        return sub_bucket_index << bucket_index
+
+    def _highest_equivalent_value(self, index: int) -> int:
+        return self._lowest_equivalent_value(index + 1) - 1
+
+    def record(self, value: int, count: int = 1) -> None:
+        index = self._index_of(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total_count += count
+
+    def remove(self, value: int, count: int = 1) -> None:
+        index = self._index_of(value)
+        remaining = self.counts[index] - count
+        if remaining > 0:
+            self.counts[index] = remaining
+        else:
+            del self.counts[index]
+        self.total_count -= count
+
+    def merge(self, other: "Histogram") -> None:
+        if other.significant_digits != self.significant_digits:
+            raise ValueError("Cannot merge histograms with different precision")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total_count += other.total_count
+
+    def subtract(self, other: "Histogram") -> None:
+        for index, count in other.counts.items():
+            remaining = self.counts[index] - count
+            if remaining > 0:
+                self.counts[index] = remaining
+            else:
+                del self.counts[index]
+        self.total_count -= other.total_count
+
+    def min(self) -> int:
+        if not self.counts:
+            return 0
+        return self._lowest_equivalent_value(min(self.counts))
+
+    def max(self) -> int:
+        if not self.counts:
+            return 0
+        return self._highest_equivalent_value(max(self.counts))
+
+    # Number of recorded values at or below each of the given ascending values
+    def cumulative_counts(self, values: Sequence[int]) -> List[int]:
+        counts = []
+        cumulative_count = 0
+        indexes = sorted(self.counts)
+        position = 0
+        for value in values:
+            while position < len(indexes) and self._lowest_equivalent_value(indexes[position]) <= value:
+                cumulative_count += self.counts[indexes[position]]
+                position += 1
+            counts.append(cumulative_count)
+        return counts
+
+    def percentiles(self, percentiles: Collection[float]) -> Dict[float, int]:
+        values = {percentile: 0 for percentile in percentiles}
+        if self.total_count == 0:
+            return values
+        # Walk the buckets once, resolving the percentiles in ascending order
+        pending = sorted(percentiles)
+        targets = [max(math.ceil(percentile / 100.0 * self.total_count), 1) for percentile in pending]
+        cumulative_count = 0
+        for index in sorted(self.counts):
+            cumulative_count += self.counts[index]
+            while pending and cumulative_count >= targets[0]:
+                values[pending.pop(0)] = self._highest_equivalent_value(index)
+                targets.pop(0)
+            if not pending:
+                break
+        return values
+
+
+# Requests which were sent more than this many nanoseconds after their scheduled time are counted as late
+SCHEDULE_LATENESS_THRESHOLD = 10_000_000
+
+
+class ScheduleStats(object):
+    def __init__(self, *, rate: float):
+        self.rate = rate
+        # no_ = Number Of
+        self.no_scheduled = 0
+        self.no_late = 0
+        self.no_dropped = 0
+
+    def merge(self, other: "ScheduleStats") -> None:
+        self.rate += other.rate
+        self.no_scheduled += other.no_scheduled
+        self.no_late += other.no_late
+        self.no_dropped += other.no_dropped
+
+
+# Counts and response latencies of a group of results, such as those from a single backend
+class GroupAggregate(object):
+    def __init__(self, *, significant_digits: int = 3):
+        # no_ = Number Of
+        self.no_results = 0
+        self.no_successful_results = 0
+        self.latency_histogram = Histogram(significant_digits=significant_digits)
+
+    def add(self, result: Result) -> None:
+        self.no_results += 1
+        if result.is_success:
+            self.no_successful_results += 1
+        if result.is_response:
+            self.latency_histogram.record(result.elapsed_ns)
 
-    for result in results:
+    def remove(self, result: Result) -> None:
+        self.no_results -= 1
+        if result.is_success:
+            self.no_successful_results -= 1
+        if result.is_response:
+            self.latency_histogram.remove(result.elapsed_ns)
+
+    def merge(self, other: "GroupAggregate") -> None:
+        self.no_results += other.no_results
+        self.no_successful_results += other.no_successful_results
+        self.latency_histogram.merge(other.latency_histogram)
+
+    def subtract(self, other: "GroupAggregate") -> None:
+        self.no_results -= other.no_results
+        self.no_successful_results -= other.no_successful_results
+        self.latency_histogram.subtract(other.latency_histogram)
+
+
+# Counters and histograms summarizing a set of results. Results can be removed as well as added, and aggregates can be
+# merged, including aggregates built in other processes
+class ResultAggregate(object):
+    def __init__(self, *, significant_digits: int = 3):
+        # no_ = Number Of
+        self.no_results = 0
+        self.no_successful_results = 0
+        self.no_responses = 0
+        self.no_new_connections = 0
+        # Responses over a pooled connection. Failed requests may never have had a connection, so are not counted
+        self.no_reused_connections = 0
+        self.no_checksummed = 0
+        self.no_checksum_mismatches = 0
+        self.sum_elapsed_ns = 0
+        self.sum_response_bytes = 0
+        self.sum_request_bytes = 0
+        self.sum_body_ns = 0
+        self.reason_counts: Dict[int, int] = {}
+        # Latency of responses, and time to failure of errors, by reason
+        self.reason_histograms: Dict[int, Histogram] = {}
+        self.backends: Dict[int, GroupAggregate] = {}
+        # Scenario entries are the same in every process, so unlike backends they are kept by index throughout
+        self.scenarios: Dict[int, GroupAggregate] = {}
+        self.significant_digits = significant_digits
+        self.latency_histogram = Histogram(significant_digits=significant_digits)
+        self.phase_histograms = [Histogram(significant_digits=significant_digits) for _ in PHASES]
+        self.size_histogram = Histogram(significant_digits=significant_digits)
+        self.oldest_timestamp = 0
+        self.newest_timestamp = 0
+
+    def __len__(self) -> int:
+        return self.no_results
+
+    # Reason and backend ids are only meaningful within the process which interned them, so they are pickled by name
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["reason_counts"] = {REASONS.name(reason_id): count for reason_id, count in self.reason_counts.items()}
+        state["reason_histograms"] = {
+            REASONS.name(reason_id): histogram for reason_id, histogram in self.reason_histograms.items()
+        }
+        state["backends"] = {BACKENDS.name(backend_id): backend for backend_id, backend in self.backends.items()}
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        # Reasons from other processes may overflow into the same id here
+        reason_counts: Dict[int, int] = {}
+        for reason, count in state["reason_counts"].items():
+            reason_id = REASONS.intern(reason)
+            reason_counts[reason_id] = reason_counts.get(reason_id, 0) + count
+        state["reason_counts"] = reason_counts
+        reason_histograms: Dict[int, Histogram] = {}
+        for reason, histogram in state["reason_histograms"].items():
+            reason_id = REASONS.intern(reason)
+            if reason_id in reason_histograms:
+                reason_histograms[reason_id].merge(histogram)
+            else:
+                reason_histograms[reason_id] = histogram
+        state["reason_histograms"] = reason_histograms
+        backends: Dict[int, GroupAggregate] = {}
+        for name, backend in state["backends"].items():
+            backend_id = BACKENDS.intern(name)
+            if backend_id in backends:
+                backends[backend_id].merge(backend)
+            else:
+                backends[backend_id] = backend
+        state["backends"] = backends
+        self.__dict__.update(state)
+
+    # Seconds between the oldest and newest result
+    def span(self) -> float:
+        if self.no_results == 0:
+            return 0.0
+        return (self.newest_timestamp - self.oldest_timestamp) / 1_000_000_000
+
+    def add(self, result: Result) -> None:
+        if self.no_results == 0:
+            self.oldest_timestamp = result.timestamp
+        self.newest_timestamp = max(self.newest_timestamp, result.timestamp)
+        self.no_results += 1
         if result.is_success:
-            no_successful_results += 1
-
-        if isinstance(result, ResponseResult):
-            assert result.response is not None
-            no_responses += 1
-            sum_latency += math.ceil(result.elapsed / datetime.timedelta(milliseconds=1))
-            reason = f"HTTP {result.response.status}"
-        elif isinstance(result, ErrorResult):
-            error = result.error
-            # aiohttp uses very generic errors, so we need to drill down
-            if isinstance(error, aiohttp.ClientConnectorError) and hasattr(error, "os_error"):
-                error = error.os_error
-            if isinstance(error, aiohttp.ClientConnectorCertificateError) and hasattr(error, "certificate_error"):
-                error = error.certificate_error
-
-            reason = ""
-            error_module = type(error).__module__
-            if error_module and error_module != "builtins":
-                reason += f"{error_module}."
-            reason += type(error).__qualname__
-
-        reason_counts[reason] = reason_counts.get(reason, 0) + 1
-
-    if no_results > 0:
-        success_rate = no_successful_results / no_results * 100.0
+            self.no_successful_results += 1
+        if result.new_connection:
+            self.no_new_connections += 1
+        if result.is_response:
+            self.no_responses += 1
+            if not result.new_connection:
+                self.no_reused_connections += 1
+            self.sum_elapsed_ns += result.elapsed_ns
+            self.sum_response_bytes += result.response_bytes
+            self.sum_request_bytes += result.request_bytes
+            self.sum_body_ns += max(result.phases_ns[BODY_PHASE], 0)
+            self.latency_histogram.record(result.elapsed_ns)
+            for histogram, phase_ns in zip(self.phase_histograms, result.phases_ns):
+                if phase_ns >= 0:
+                    histogram.record(phase_ns)
+            self.size_histogram.record(result.response_bytes)
+            if result.checksum >= 0:
+                self.no_checksummed += 1
+                if result.checksum_mismatch:
+                    self.no_checksum_mismatches += 1
+        self.reason_counts[result.reason_id] = self.reason_counts.get(result.reason_id, 0) + 1
+        reason_histogram = self.reason_histograms.get(result.reason_id)
+        if reason_histogram is None:
+            reason_histogram = self.reason_histograms[result.reason_id] = Histogram(
+                significant_digits=self.significant_digits
+            )
+        reason_histogram.record(result.elapsed_ns)
+        if result.backend_id != NO_BACKEND:
+            backend = self.backends.get(result.backend_id)
+            if backend is None:
+                backend = self.backends[result.backend_id] = GroupAggregate(significant_digits=self.significant_digits)
+            backend.add(result)
+        scenario = self.scenarios.get(result.scenario_id)
+        if scenario is None:
+            scenario = self.scenarios[result.scenario_id] = GroupAggregate(significant_digits=self.significant_digits)
+        scenario.add(result)
+
+    def remove(self, result: Result) -> None:
+        self.no_results -= 1
+        if result.is_success:
+            self.no_successful_results -= 1
+        if result.new_connection:
+            self.no_new_connections -= 1
+        if result.is_response:
+            self.no_responses -= 1
+            if not result.new_connection:
+                self.no_reused_connections -= 1
+            self.sum_elapsed_ns -= result.elapsed_ns
+            self.sum_response_bytes -= result.response_bytes
+            self.sum_request_bytes -= result.request_bytes
+            self.sum_body_ns -= max(result.phases_ns[BODY_PHASE], 0)
+            self.latency_histogram.remove(result.elapsed_ns)
+            for histogram, phase_ns in zip(self.phase_histograms, result.phases_ns):
+                if phase_ns >= 0:
+                    histogram.remove(phase_ns)
+            self.size_histogram.remove(result.response_bytes)
+            if result.checksum >= 0:
+                self.no_checksummed -= 1
+                if result.checksum_mismatch:
+                    self.no_checksum_mismatches -= 1
+        count = self.reason_counts[result.reason_id] - 1
+        if count > 0:
+            self.reason_counts[result.reason_id] = count
+        else:
+            del self.reason_counts[result.reason_id]
+        reason_histogram = self.reason_histograms[result.reason_id]
+        reason_histogram.remove(result.elapsed_ns)
+        if reason_histogram.total_count == 0:
+            del self.reason_histograms[result.reason_id]
+        if result.backend_id != NO_BACKEND:
+            backend = self.backends[result.backend_id]
+            backend.remove(result)
+            if backend.no_results == 0:
+                del self.backends[result.backend_id]
+        scenario = self.scenarios[result.scenario_id]
+        scenario.remove(result)
+        if scenario.no_results == 0:
+            del self.scenarios[result.scenario_id]
+
+    def merge(self, other: "ResultAggregate") -> None:
+        if other.no_results == 0:
+            return
+        if self.no_results == 0:
+            self.oldest_timestamp = other.oldest_timestamp
+            self.newest_timestamp = other.newest_timestamp
+        else:
+            self.oldest_timestamp = min(self.oldest_timestamp, other.oldest_timestamp)
+            self.newest_timestamp = max(self.newest_timestamp, other.newest_timestamp)
+        self.no_results += other.no_results
+        self.no_successful_results += other.no_successful_results
+        self.no_responses += other.no_responses
+        self.no_new_connections += other.no_new_connections
+        self.no_reused_connections += other.no_reused_connections
+        self.no_checksummed += other.no_checksummed
+        self.no_checksum_mismatches += other.no_checksum_mismatches
+        self.sum_elapsed_ns += other.sum_elapsed_ns
+        self.sum_response_bytes += other.sum_response_bytes
+        self.sum_request_bytes += other.sum_request_bytes
+        self.sum_body_ns += other.sum_body_ns
+        for reason_id, count in other.reason_counts.items():
+            self.reason_counts[reason_id] = self.reason_counts.get(reason_id, 0) + count
+        for reason_id, other_histogram in other.reason_histograms.items():
+            reason_histogram = self.reason_histograms.get(reason_id)
+            if reason_histogram is None:
+                reason_histogram = self.reason_histograms[reason_id] = Histogram(
+                    significant_digits=self.significant_digits
+                )
+            reason_histogram.merge(other_histogram)
+        for backend_id, other_backend in other.backends.items():
+            backend = self.backends.get(backend_id)
+            if backend is None:
+                backend = self.backends[backend_id] = GroupAggregate(significant_digits=self.significant_digits)
+            backend.merge(other_backend)
+        for scenario_id, other_scenario in other.scenarios.items():
+            scenario = self.scenarios.get(scenario_id)
+            if scenario is None:
+                scenario = self.scenarios[scenario_id] = GroupAggregate(significant_digits=self.significant_digits)
+            scenario.merge(other_scenario)
+        self.latency_histogram.merge(other.latency_histogram)
+        for histogram, other_histogram in zip(self.phase_histograms, other.phase_histograms):
+            histogram.merge(other_histogram)
+        self.size_histogram.merge(other.size_histogram)
+
+    # The inverse of merge(), for removing an aggregate which was previously merged in. Timestamps are left as they are
+    def subtract(self, other: "ResultAggregate") -> None:
+        self.no_results -= other.no_results
+        self.no_successful_results -= other.no_successful_results
+        self.no_responses -= other.no_responses
+        self.no_new_connections -= other.no_new_connections
+        self.no_reused_connections -= other.no_reused_connections
+        self.no_checksummed -= other.no_checksummed
+        self.no_checksum_mismatches -= other.no_checksum_mismatches
+        self.sum_elapsed_ns -= other.sum_elapsed_ns
+        self.sum_response_bytes -= other.sum_response_bytes
+        self.sum_request_bytes -= other.sum_request_bytes
+        self.sum_body_ns -= other.sum_body_ns
+        for reason_id, count in other.reason_counts.items():
+            remaining = self.reason_counts[reason_id] - count
+            if remaining > 0:
+                self.reason_counts[reason_id] = remaining
+            else:
+                del self.reason_counts[reason_id]
+        for reason_id, other_histogram in other.reason_histograms.items():
+            reason_histogram = self.reason_histograms[reason_id]
+            reason_histogram.subtract(other_histogram)
+            if reason_histogram.total_count == 0:
+                del self.reason_histograms[reason_id]
+        for backend_id, other_backend in other.backends.items():
+            backend = self.backends[backend_id]
+            backend.subtract(other_backend)
+            if backend.no_results == 0:
+                del self.backends[backend_id]
+        for scenario_id, other_scenario in other.scenarios.items():
+            scenario = self.scenarios[scenario_id]
+            scenario.subtract(other_scenario)
+            if scenario.no_results == 0:
+                del self.scenarios[scenario_id]
+        self.latency_histogram.subtract(other.latency_histogram)
+        for histogram, other_histogram in zip(self.phase_histograms, other.phase_histograms):
+            histogram.subtract(other_histogram)
+        self.size_histogram.subtract(other.size_histogram)
+
+
+WINDOW_LENGTHS = (1, 10, 60)
+
+
+# Aggregates over the last few completed seconds of wall-clock time. Results are collected in per-second buckets, and a
+# running aggregate per window length has each second merged in when it completes and subtracted once it falls out of
+# the window, so reading a window costs the same however many results it covers
+class TimeWindows(object):
+    def __init__(self, *, lengths: Sequence[int] = WINDOW_LENGTHS, significant_digits: int = 3):
+        self.lengths = tuple(lengths)
+        self.significant_digits = significant_digits
+        self.buckets: Dict[int, ResultAggregate] = {}
+        self.windows = {length: ResultAggregate(significant_digits=significant_digits) for length in self.lengths}
+        self.current_second: Optional[int] = None
+        self.first_timestamp: Optional[int] = None
+
+    # Only the windows are shared with other processes; the buckets are needed to keep them up to date
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["buckets"] = {}
+        return state
+
+    def _reset(self) -> None:
+        self.buckets = {}
+        self.windows = {length: ResultAggregate(significant_digits=self.significant_digits) for length in self.lengths}
+
+    # now is a time.perf_counter_ns() timestamp
+    def advance(self, now: int) -> None:
+        second = now // 1_000_000_000
+        if self.current_second is None or second - self.current_second > max(self.lengths):
+            self._reset()
+            self.current_second = second
+            return
+        while self.current_second < second:
+            completed = self.current_second
+            bucket = self.buckets.get(completed)
+            for length, window in self.windows.items():
+                if bucket is not None:
+                    window.merge(bucket)
+                expired = self.buckets.get(completed - length)
+                if expired is not None:
+                    window.subtract(expired)
+            self.buckets.pop(completed - max(self.lengths), None)
+            self.current_second = completed + 1
+
+    def add(self, result: Result) -> None:
+        self.advance(result.timestamp)
+        assert self.current_second is not None
+        if self.first_timestamp is None or result.timestamp < self.first_timestamp:
+            self.first_timestamp = result.timestamp
+        second = result.timestamp // 1_000_000_000
+        # Results which complete out of order still land in the bucket for their own second
+        if second < self.current_second - max(self.lengths):
+            return
+        bucket = self.buckets.get(second)
+        if bucket is None:
+            bucket = self.buckets[second] = ResultAggregate(significant_digits=self.significant_digits)
+        bucket.add(result)
+        for length, window in self.windows.items():
+            if self.current_second - length <= second < self.current_second:
+                window.add(result)
+
+    # Seconds a window covers, which is less than its length early in the run. Coverage starts at the first result
+    # rather than the start of its second, so that rates over a partial first second are not understated
+    def covered(self, length: int) -> float:
+        if self.current_second is None or self.first_timestamp is None:
+            return 0.0
+        return min(float(length), max(self.current_second * 1_000_000_000 - self.first_timestamp, 0) / 1_000_000_000)
+
+    def merge(self, other: "TimeWindows") -> None:
+        if other.first_timestamp is not None:
+            if self.first_timestamp is None or other.first_timestamp < self.first_timestamp:
+                self.first_timestamp = other.first_timestamp
+        if other.current_second is not None:
+            if self.current_second is None or other.current_second > self.current_second:
+                self.current_second = other.current_second
+        for length, window in self.windows.items():
+            other_window = other.windows.get(length)
+            if other_window is not None:
+                window.merge(other_window)
+
+
+# A ring buffer of results with deque(maxlen=...) semantics. Results are stored column-wise in preallocated arrays, and
+# the aggregate is kept up to date as results are appended and evicted so that summarizing the history never needs a
+# rescan
+class ResultHistory(object):
+    def __init__(self, *, maxlen: int, significant_digits: int = 3):
+        self.maxlen = maxlen
+        self.statuses = array("H", [0]) * maxlen
+        self.reason_ids = array("I", [0]) * maxlen
+        self.elapsed_ns = array("q", [0]) * maxlen
+        self.response_bytes = array("q", [0]) * maxlen
+        self.request_bytes = array("q", [0]) * maxlen
+        self.timestamps = array("q", [0]) * maxlen
+        self.new_connections = array("B", [0]) * maxlen
+        self.checksums = array("q", [-1]) * maxlen
+        self.checksum_mismatches = array("B", [0]) * maxlen
+        self.backend_ids = array("I", [0]) * maxlen
+        self.scenario_ids = array("H", [0]) * maxlen
+        self.phases_ns = [array("q", [-1]) * maxlen for _ in PHASES]
+        # Index of the next slot to write, which is also the oldest result once the buffer is full
+        self.head = 0
+        self.size = 0
+        self.aggregate = ResultAggregate(significant_digits=significant_digits)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[Result]:
+        start = (self.head - self.size) % self.maxlen
+        for offset in range(self.size):
+            yield self._load((start + offset) % self.maxlen)
+
+    def _load(self, index: int) -> Result:
+        return Result(
+            status=self.statuses[index],
+            reason_id=self.reason_ids[index],
+            elapsed_ns=self.elapsed_ns[index],
+            response_bytes=self.response_bytes[index],
+            request_bytes=self.request_bytes[index],
+            timestamp=self.timestamps[index],
+            new_connection=bool(self.new_connections[index]),
+            phases_ns=tuple(column[index] for column in self.phases_ns),
+            checksum=self.checksums[index],
+            checksum_mismatch=bool(self.checksum_mismatches[index]),
+            backend_id=self.backend_ids[index],
+            scenario_id=self.scenario_ids[index],
+        )
+
+    def append(self, result: Result) -> None:
+        index = self.head
+        if self.size == self.maxlen:
+            self.aggregate.remove(self._load(index))
+        else:
+            self.size += 1
+        self.statuses[index] = result.status
+        self.reason_ids[index] = result.reason_id
+        self.elapsed_ns[index] = result.elapsed_ns
+        self.response_bytes[index] = result.response_bytes
+        self.request_bytes[index] = result.request_bytes
+        self.timestamps[index] = result.timestamp
+        self.new_connections[index] = result.new_connection
+        self.checksums[index] = result.checksum
+        self.checksum_mismatches[index] = result.checksum_mismatch
+        self.backend_ids[index] = result.backend_id
+        self.scenario_ids[index] = result.scenario_id
+        for column, phase_ns in zip(self.phases_ns, result.phases_ns):
+            column[index] = phase_ns
+        self.head = (index + 1) % self.maxlen
+        self.aggregate.add(result)
+        self.aggregate.oldest_timestamp = self.timestamps[(self.head - self.size) % self.maxlen]
+        self.aggregate.newest_timestamp = result.timestamp
+
+
+# Everything a process knows about the run so far, in a form which can be pickled and merged with other processes'.
+# results covers the request history, windows the last few seconds and totals every request since the start of the run
+class RunStats(object):
+    def __init__(
+        self,
+        *,
+        results: ResultAggregate,
+        totals: ResultAggregate,
+        windows: TimeWindows,
+        connections: ConnectionStats,
+        schedule: Optional[ScheduleStats] = None,
+    ):
+        self.results = results
+        self.totals = totals
+        self.windows = windows
+        self.connections = connections
+        self.schedule = schedule
+        self.in_flight = 0
+
+    def merge(self, other: "RunStats") -> None:
+        self.results.merge(other.results)
+        self.totals.merge(other.totals)
+        self.windows.merge(other.windows)
+        self.connections.merge(other.connections)
+        if self.schedule is not None and other.schedule is not None:
+            self.schedule.merge(other.schedule)
+        self.in_flight += other.in_flight
+
+
+LOG_FORMATS = ("jsonl", "csv")
+LOG_FIELDS = (
+    "timestamp_ns",
+    "elapsed_ns",
+    "status",
+    "reason",
+    "response_bytes",
+    "request_bytes",
+    "new_connection",
+    "backend",
+    "scenario",
+    *(f"{phase.lower()}_ns" for phase in PHASES),
+)
+# Results are handed to the writer thread in batches of this many, or after this many nanoseconds, whichever is first
+LOG_BATCH_SIZE = 1024
+LOG_BATCH_INTERVAL = 1_000_000_000
+
+
+# Truncates the log and writes its header before any process starts appending to it
+def prepare_result_log(args: argparse.Namespace) -> None:
+    if args.log_results is None:
+        return
+    with open(args.log_results, "w", newline="") as f:
+        if args.log_format == "csv":
+            csv.writer(f).writerow(LOG_FIELDS)
+
+
+# Streams results to a file. The event loop only collects results into batches; formatting and writing happen on a
+# background thread. Subclasses format batches
+class BatchWriter(abc.ABC):
+    def __init__(self, *, file: BinaryIO):
+        # Results are timestamped with time.perf_counter_ns(), which is converted to time since the epoch for files
+        self.clock_offset = time.time_ns() - time.perf_counter_ns()
+        self.file = file
+        self.batch: List[Result] = []
+        self.batch_started = 0
+        self.batches: "queue.Queue[Optional[List[Result]]]" = queue.Queue()
+        self.writer = threading.Thread(target=self._write_batches, name="result-writer", daemon=True)
+        self.writer.start()
+
+    def log(self, result: Result) -> None:
+        if not self.batch:
+            self.batch_started = result.timestamp
+        self.batch.append(result)
+        if len(self.batch) >= LOG_BATCH_SIZE or result.timestamp - self.batch_started >= LOG_BATCH_INTERVAL:
+            self.batches.put(self.batch)
+            self.batch = []
+
+    # Writes out any remaining results and waits for the writer thread to finish
+    def close(self) -> None:
+        if self.batch:
+            self.batches.put(self.batch)
+            self.batch = []
+        self.batches.put(None)
+        self.writer.join()
+        self._finish()
+        self.file.close()
+
+    @abc.abstractmethod
+    def _format(self, batch: List[Result]) -> bytes:
+        pass
+
+    # Called once every batch has been written
+    def _finish(self) -> None:
+        pass
+
+    def _write_batches(self) -> None:
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            self.file.write(self._format(batch))
+
+
+# Writes --log-results records. Every batch is written with a single append, so several processes can share the file
+class ResultLogger(BatchWriter):
+    def __init__(self, *, path: str, _format: str, scenario: Scenario):
+        super().__init__(file=open(path, "ab", buffering=0))
+        self.format = _format
+        self.scenario_names = [entry.name for entry in scenario.entries]
+
+    def _record(self, result: Result) -> Dict[str, Any]:
+        record = {
+            "timestamp_ns": result.timestamp + self.clock_offset,
+            "elapsed_ns": result.elapsed_ns,
+            "status": result.status,
+            "reason": result.reason,
+            "response_bytes": result.response_bytes,
+            "request_bytes": result.request_bytes,
+            "new_connection": result.new_connection,
+            "backend": BACKENDS.name(result.backend_id),
+            "scenario": self.scenario_names[result.scenario_id],
+        }
+        for phase, phase_ns in zip(PHASES, result.phases_ns):
+            record[f"{phase.lower()}_ns"] = phase_ns if phase_ns >= 0 else None
+        return record
+
+    def _format(self, batch: List[Result]) -> bytes:
+        if self.format == "csv":
+            output = io.StringIO(newline="")
+            csv.DictWriter(output, LOG_FIELDS).writerows(self._record(result) for result in batch)
+            return output.getvalue().encode()
+        return "".join(json.dumps(self._record(result)) + "\n" for result in batch).encode()
+
+
+def build_result_logger(args: argparse.Namespace) -> Optional[ResultLogger]:
+    if args.log_results is None:
+        return None
+    return ResultLogger(path=args.log_results, _format=args.log_format, scenario=build_scenario(args))
+
+
+# Recordings are laid out as:
+#
+#   RECORDING_MAGIC, header length, JSON header describing the run, padding to a multiple of 8 bytes
+#   one RECORD per request
+#   JSON trailer holding the reason and backend names which ids in records refer to, trailer length, TRAILER_MAGIC
+#
+# Records are fixed-width and aligned so that the whole block can be memory-mapped as an array. A recording without a
+# trailer, from a run which did not finish cleanly, still has readable records
+RECORDING_MAGIC = b"WEBTOPR1"
+TRAILER_MAGIC = b"WEBTOPT1"
+RECORDING_LENGTH = struct.Struct("<Q")
+RECORD = struct.Struct("<qqqq5qHHIIBB2x")
+RECORD_FIELDS = (
+    ("timestamp_ns", "<i8"),
+    ("elapsed_ns", "<i8"),
+    ("response_bytes", "<i8"),
+    ("request_bytes", "<i8"),
+    *((f"{phase.lower()}_ns", "<i8") for phase in PHASES),
+    ("status", "<u2"),
+    ("scenario_id", "<u2"),
+    ("reason_id", "<u4"),
+    ("backend_id", "<u4"),
+    ("new_connection", "u1"),
+    # 0 when bodies are not checksummed, 1 when the checksum matched and 2 when it did not
+    ("checksum", "u1"),
+)
+
+
+def record_padding(length: int) -> int:
+    return -length % 8
+
+
+# Writes a --record recording. Unlike logs, each process writes its own recording, since reason and backend ids are
+# only meaningful within the process which interned them
+class ResultRecorder(BatchWriter):
+    def __init__(self, *, path: str, header: Dict[str, Any]):
+        super().__init__(file=open(path, "wb", buffering=0))
+        header = dict(header, clock_offset_ns=self.clock_offset, record_size=RECORD.size)
+        encoded = json.dumps(header).encode()
+        self.file.write(
+            RECORDING_MAGIC + RECORDING_LENGTH.pack(len(encoded)) + encoded + b"\0" * record_padding(len(encoded))
+        )
+
+    def _format(self, batch: List[Result]) -> bytes:
+        buffer = bytearray(RECORD.size * len(batch))
+        for index, result in enumerate(batch):
+            if result.checksum < 0:
+                checksum = 0
+            else:
+                checksum = 2 if result.checksum_mismatch else 1
+            RECORD.pack_into(
+                buffer,
+                index * RECORD.size,
+                result.timestamp,
+                result.elapsed_ns,
+                result.response_bytes,
+                result.request_bytes,
+                *result.phases_ns,
+                result.status,
+                result.scenario_id,
+                result.reason_id,
+                result.backend_id,
+                result.new_connection,
+                checksum,
+            )
+        return bytes(buffer)
+
+    def _finish(self) -> None:
+        encoded = json.dumps({"reasons": REASONS.names, "backends": BACKENDS.names}).encode()
+        self.file.write(encoded + RECORDING_LENGTH.pack(len(encoded)) + TRAILER_MAGIC)
+
+
+def build_result_recorder(args: argparse.Namespace) -> Optional[ResultRecorder]:
+    if args.record is None:
+        return None
+    scenario = build_scenario(args)
+    header = {
+        "argv": args.argv,
+        "url": str(args.url) if args.url is not None else None,
+        "method": args.method,
+        "scenario": scenario.path,
+        "scenario_names": [entry.name for entry in scenario.entries],
+    }
+    return ResultRecorder(path=args.record, header=header)
+
+
+LATENCY_PERCENTILES = (50.0, 90.0, 99.0, 99.9, 99.99)
+
+
+def format_percentile(percentile: float) -> str:
+    return f"p{percentile:g}"
+
+
+def format_latency(nanoseconds: float) -> str:
+    return f"{nanoseconds / 1_000_000:.3f}ms"
+
+
+def latency_percentiles(histogram: Histogram, percentiles: Sequence[float] = LATENCY_PERCENTILES) -> Dict[str, str]:
+    values = histogram.percentiles(percentiles)
+    summary = {"min": format_latency(histogram.min())}
+    for percentile in percentiles:
+        summary[format_percentile(percentile)] = format_latency(values[percentile])
+    summary["max"] = format_latency(histogram.max())
+    return summary
+
+
+def success_rate(results: ResultAggregate) -> float:
+    if len(results) > 0:
+        return results.no_successful_results / len(results) * 100.0
+    return 0.0
+
+
+WINDOW_PERCENTILES = (50.0, 90.0, 99.0)
+
+
+def format_bandwidth(bytes_per_second: float) -> str:
+    return f"{bytes_per_second / 1_000_000:.3f}MB/s"
+
+
+def throughput(results: ResultAggregate, seconds: float) -> dict:
+    if seconds <= 0:
+        return {}
+    return {
+        "Requests/sec": f"{results.no_results / seconds:.1f}",
+        "Successful Requests/sec": f"{results.no_successful_results / seconds:.1f}",
+        "Response Bytes/sec": format_bandwidth(results.sum_response_bytes / seconds),
+        "Request Bytes/sec": format_bandwidth(results.sum_request_bytes / seconds),
+    }
+
+
+# seconds is the length of time the results were collected over, used to turn counts into rates
+def window_summary(results: ResultAggregate, seconds: float) -> dict:
+    percentiles = results.latency_histogram.percentiles(WINDOW_PERCENTILES)
+    latency = {
+        format_percentile(percentile): format_latency(percentiles[percentile]) for percentile in WINDOW_PERCENTILES
+    }
+    latency["max"] = format_latency(results.latency_histogram.max())
+    return {
+        "Requests": len(results),
+        "Success Rate": f"{success_rate(results):3.3f}%",
+        "Latency": latency,
+        "Throughput": throughput(results, seconds),
+    }
+
+
+def group_summary(group: GroupAggregate) -> dict:
+    return {
+        "Count": group.no_results,
+        "Success Rate": f"{group.no_successful_results / group.no_results * 100.0:3.3f}%",
+        "Latency": latency_percentiles(group.latency_histogram, WINDOW_PERCENTILES),
+    }
+
+
+def build_stats(
+    *, url: Optional[URL], method: str, stats: RunStats, scenario: Optional[Scenario] = None
+) -> Dict[str, Any]:
+    results = stats.results
+    no_results = len(results)
+
+    if results.no_responses > 0:
+        avg_latency = results.sum_elapsed_ns / results.no_responses
     else:
-        success_rate = 0.0
+        avg_latency = 0.0
+
+    # The live view is cut off at the bottom of the terminal, so the sections most worth watching come first
+    summary: Dict[str, Any] = {}
+    if scenario is not None:
+        summary["Scenario"] = scenario.path
+    else:
+        summary["URL"] = str(url)
+        summary["Verb"] = method
+    summary.update(
+        {
+            "Sample Size": no_results,
+            "Success Rate": f"{success_rate(results):3.9f}%",
+            "Average Latency": format_latency(avg_latency),
+            "Latency Percentiles": latency_percentiles(results.latency_histogram),
+            "Count by Reason": {
+                REASONS.name(reason_id): {
+                    "Count": count,
+                    "Latency": latency_percentiles(results.reason_histograms[reason_id], WINDOW_PERCENTILES),
+                }
+                for reason_id, count in results.reason_counts.items()
+            },
+        }
+    )
+
+    windows = {
+        f"{length}s": window_summary(window, stats.windows.covered(length))
+        for length, window in stats.windows.windows.items()
+    }
+    windows["Total"] = window_summary(stats.totals, stats.totals.span())
+    summary["Windows"] = windows
+
+    schedule = stats.schedule
+    if schedule is not None:
+        summary["Schedule"] = {
+            "Target Rate": f"{schedule.rate:g}/s",
+            "Scheduled": schedule.no_scheduled,
+            "Late": schedule.no_late,
+            "Dropped": schedule.no_dropped,
+            "In Flight": stats.in_flight,
+        }
+
+    summary["Backends"] = {
+        BACKENDS.name(backend_id): group_summary(backend) for backend_id, backend in results.backends.items()
+    }
+
+    if scenario is not None:
+        summary["Scenarios"] = {
+            scenario.entries[scenario_id].name: group_summary(group)
+            for scenario_id, group in sorted(results.scenarios.items())
+        }
 
-    if no_responses > 0:
-        avg_latency = math.ceil(sum_latency / no_responses)
+    summary["Latency by Phase"] = {
+        phase: latency_percentiles(histogram)
+        for phase, histogram in zip(PHASES, results.phase_histograms)
+        if histogram.total_count > 0
+    }
+
+    no_connected_results = results.no_reused_connections + results.no_new_connections
+    if no_connected_results > 0:
+        reuse_ratio = results.no_reused_connections / no_connected_results * 100.0
+    else:
+        reuse_ratio = 0.0
+    span = results.span()
+    if span > 0:
+        new_connection_rate = results.no_new_connections / span
     else:
-        avg_latency = 0
-
-    summary = {
-        "URL": str(url),
-        "Verb": method,
-        "Sample Size": no_results,
-        "Success Rate": f"{success_rate:3.9f}%",
-        "Average Latency": f"{avg_latency}ms",
-        "Count by Reason": reason_counts,
+        new_connection_rate = 0.0
+    summary["Connections"] = {
+        "Reuse Ratio": f"{reuse_ratio:3.3f}%",
+        "New Connections/sec": f"{new_connection_rate:.1f}",
+        "Retired": stats.connections.no_retired_connections,
+        "DNS Lookups": stats.connections.no_dns_lookups,
+        "DNS Cache Hits": stats.connections.no_dns_cache_hits,
+        "DNS Shared Lookups": stats.connections.no_dns_shared_lookups,
     }
 
+    size_percentiles = results.size_histogram.percentiles(WINDOW_PERCENTILES)
+    body: Dict[str, Any] = {
+        "Size": {
+            "min": results.size_histogram.min(),
+            **{format_percentile(percentile): size_percentiles[percentile] for percentile in WINDOW_PERCENTILES},
+            "max": results.size_histogram.max(),
+        },
+    }
+    if results.sum_body_ns > 0:
+        body["Transfer Rate"] = format_bandwidth(results.sum_response_bytes / (results.sum_body_ns / 1_000_000_000))
+    if results.no_checksummed > 0:
+        body["Checksum Mismatches"] = results.no_checksum_mismatches
+    summary["Body"] = body
+
     return summary
 
 
@@ -225,73 +2199,947 @@ def render_stats(stats: dict, _format: str) -> str:
     return output
 
 
-async def main() -> None:
-    args = parse_args()
-    assert are_args_valid(args)
+# Redraws output in place with ANSI escape sequences, rewriting only the lines which changed since the last frame
+class TerminalRenderer(object):
+    def __init__(self, *, stream: TextIO = sys.stdout):
+        self.stream = stream
+        self.lines: Optional[List[str]] = None
+
+    def start(self) -> None:
+        # Clear the screen and hide the cursor
+        self.stream.write("\x1b[2J\x1b[?25l")
+        self.stream.flush()
+        self.lines = []
+
+    def stop(self) -> None:
+        if self.lines is None:
+            return
+        # Clear the last frame, which the final summary takes the place of, and show the cursor again
+        self.stream.write("\x1b[H\x1b[J\x1b[?25h")
+        self.stream.flush()
+        self.lines = None
+
+    def draw(self, output: str) -> None:
+        if self.lines is None:
+            self.start()
+        assert self.lines is not None
+
+        columns, rows = shutil.get_terminal_size()
+        # Lines which wrap or scroll would throw off cursor positioning
+        lines = [line[:columns] for line in output.splitlines()[: rows - 1]]
+        chunks = []
+        for row, line in enumerate(lines):
+            if row >= len(self.lines) or self.lines[row] != line:
+                chunks.append(f"\x1b[{row + 1};1H{line}\x1b[K")
+        if len(lines) < len(self.lines):
+            chunks.append(f"\x1b[{len(lines) + 1};1H\x1b[J")
+        self.lines = lines
+
+        if chunks:
+            self.stream.write("".join(chunks))
+            self.stream.flush()
+
+
+RENDER_INTERVAL = 0.1
+MAX_RENDER_INTERVAL = 2.0
+
+# Upper bounds of the latency histogram buckets exposed to Prometheus, in seconds
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _metric_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Counters must keep every digit, or long runs would stop appearing to increase
+def _metric_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(int(value))
+    return repr(float(value))
+
+
+# Renders stats in the Prometheus text exposition format. Counters cover the whole run, gauges the request history
+def build_metrics(stats: RunStats, scenario: Optional[Scenario] = None) -> str:
+    lines = []
+
+    def metric(name: str, _type: str, description: str, samples: Collection[Tuple[str, float]]) -> None:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{labels} {_metric_value(value)}")
+
+    totals = stats.totals
+    metric(
+        "webtop_requests_total",
+        "counter",
+        "Requests completed, by reason",
+        [
+            (f'{{reason="{_metric_label(REASONS.name(reason_id))}"}}', count)
+            for reason_id, count in totals.reason_counts.items()
+        ],
+    )
+    metric(
+        "webtop_backend_requests_total",
+        "counter",
+        "Requests completed, by the address of the server they were sent to",
+        [
+            (f'{{backend="{_metric_label(BACKENDS.name(backend_id))}"}}', backend.no_results)
+            for backend_id, backend in totals.backends.items()
+        ],
+    )
+    if scenario is not None:
+        metric(
+            "webtop_scenario_requests_total",
+            "counter",
+            "Requests completed, by scenario entry",
+            [
+                (f'{{scenario="{_metric_label(scenario.entries[scenario_id].name)}"}}', group.no_results)
+                for scenario_id, group in totals.scenarios.items()
+            ],
+        )
+    metric(
+        "webtop_successful_requests_total",
+        "counter",
+        "Requests which received a 2XX or 3XX response",
+        [("", totals.no_successful_results)],
+    )
 
-    resolver: Callable = aiohttp.resolver.DefaultResolver
-    if args.resolve is not None:
-        host, address = args.resolve.split(":")
-        if args.url.host == host:
-            custom_resolution = {host: address}
+    results = stats.results
+    if len(results) > 0:
+        success_ratio = results.no_successful_results / len(results)
+    else:
+        success_ratio = 0.0
+    metric(
+        "webtop_success_ratio",
+        "gauge",
+        "Fraction of requests in the request history which succeeded",
+        [("", success_ratio)],
+    )
 
-            def resolver():
-                return CustomResolver(custom_mappings=custom_resolution)
+    histogram = totals.latency_histogram
+    bucket_counts = histogram.cumulative_counts([int(bound * 1_000_000_000) for bound in METRICS_LATENCY_BUCKETS])
+    lines.append("# HELP webtop_request_duration_seconds Response latency")
+    lines.append("# TYPE webtop_request_duration_seconds histogram")
+    for bound, count in zip(METRICS_LATENCY_BUCKETS, bucket_counts):
+        lines.append(f'webtop_request_duration_seconds_bucket{{le="{bound:g}"}} {count}')
+    lines.append(f'webtop_request_duration_seconds_bucket{{le="+Inf"}} {histogram.total_count}')
+    lines.append(f"webtop_request_duration_seconds_sum {_metric_value(totals.sum_elapsed_ns / 1_000_000_000)}")
+    lines.append(f"webtop_request_duration_seconds_count {histogram.total_count}")
+
+    metric("webtop_in_flight_requests", "gauge", "Requests currently in flight", [("", stats.in_flight)])
+    metric(
+        "webtop_new_connections_total",
+        "counter",
+        "Requests which opened a new connection",
+        [("", totals.no_new_connections)],
+    )
+    metric(
+        "webtop_reused_connections_total",
+        "counter",
+        "Responses which reused a pooled connection",
+        [("", totals.no_reused_connections)],
+    )
+    metric(
+        "webtop_retired_connections_total",
+        "counter",
+        "Connections closed for reaching --max-requests-per-connection or --connection-max-age",
+        [("", stats.connections.no_retired_connections)],
+    )
+    metric(
+        "webtop_dns_lookups_total",
+        "counter",
+        "DNS lookups made for new connections",
+        [("", stats.connections.no_dns_lookups)],
+    )
+    metric(
+        "webtop_dns_cache_hits_total",
+        "counter",
+        "New connections whose addresses came from the DNS cache",
+        [("", stats.connections.no_dns_cache_hits)],
+    )
+    metric(
+        "webtop_dns_shared_lookups_total",
+        "counter",
+        "New connections which waited on a DNS lookup already in progress",
+        [("", stats.connections.no_dns_shared_lookups)],
+    )
 
-    results: Deque[Result] = deque(maxlen=args.request_history)
-    shutdown_event = asyncio.Event()
+    schedule = stats.schedule
+    if schedule is not None:
+        metric(
+            "webtop_scheduled_requests_total", "counter", "Requests scheduled by --rate", [("", schedule.no_scheduled)]
+        )
+        metric("webtop_late_requests_total", "counter", "Scheduled requests sent late", [("", schedule.no_late)])
+        metric(
+            "webtop_dropped_requests_total",
+            "counter",
+            "Scheduled requests dropped because every worker was busy",
+            [("", schedule.no_dropped)],
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+def parse_listen_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host.strip("[]"), int(port)
+
+
+def listen_address_is_valid(address: Optional[str]) -> bool:
+    if address is None:
+        return True
+    try:
+        host, port = parse_listen_address(address)
+    except ValueError:
+        return False
+    return bool(host) and 0 <= port <= 65535
+
+
+async def serve_metrics(
+    *, args: argparse.Namespace, get_stats: Callable[[], RunStats], shutdown_event: asyncio.Event
+) -> None:
+    async def metrics(_: web.Request) -> web.Response:
+        return web.Response(
+            text=build_metrics(get_stats(), scenario=args.scenario),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
 
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    host, port = parse_listen_address(args.metrics_listen)
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    try:
+        await shutdown_event.wait()
+    finally:
+        await runner.cleanup()
+
+
+def build_resolver(args: argparse.Namespace, *, stats: ConnectionStats) -> aiohttp.resolver.AbstractResolver:
+    if args.dns_cache_ttl is not None:
+        ttl: Optional[float] = durationpy.from_str(args.dns_cache_ttl).total_seconds()
+    else:
+        ttl = None
+    resolver = CachingResolver(stats=stats, ttl=ttl, spread=args.dns_spread)
+    if args.resolve is not None:
+        return CustomResolver(custom_mappings=parse_resolve(args.resolve), resolver=resolver)
+    return resolver
+
+
+def build_connector(args: argparse.Namespace) -> PoolingConnector:
+    stats = ConnectionStats()
+    return PoolingConnector(
+        force_close=not _str_to_bool(args.keepalive, default=False),
+        limit=args.max_connections,
+        max_requests_per_connection=args.max_requests_per_connection,
+        max_connection_age=args.connection_max_age,
+        resolver=build_resolver(args, stats=stats),
+        # CachingResolver does its own caching
+        use_dns_cache=False,
+        stats=stats,
+        verify_ssl=_str_to_bool(args.verify_tls, default=True),
+        split_tls=args.loop != "uvloop",
+    )
+
+
+# Sets shutdown_event on SIGINT/SIGTERM, and returns the tasks which end the test once --duration has passed
+def install_shutdown_triggers(args: argparse.Namespace, shutdown_event: asyncio.Event) -> List[Awaitable]:
     def shutdown_signal_handler(_, __):
         shutdown_event.set()
 
     for shutdown_signal in (signal.SIGINT, signal.SIGTERM):
         signal.signal(shutdown_signal, shutdown_signal_handler)
 
-    tasks = []
+    if args.duration is None:
+        return []
 
-    if args.duration is not None:
-        duration = durationpy.from_str(args.duration)
+    duration = durationpy.from_str(args.duration).total_seconds()
 
-        async def stop_test():
-            await asyncio.wait([shutdown_event.wait()], timeout=duration)
+    async def stop_test():
+        try:
+            await asyncio.wait_for(shutdown_event.wait(), timeout=duration)
+        except asyncio.TimeoutError:
             shutdown_event.set()
 
-        tasks.append(stop_test())
+    return [stop_test()]
+
+
+def parse_latency(latency: str) -> int:
+    return int(durationpy.from_str(latency).total_seconds() * 1_000_000_000)
+
+
+# Checks the --max-error-rate, --max-p99 and --min-rps thresholds against the stats of the whole run
+def check_thresholds(args: argparse.Namespace, totals: ResultAggregate) -> Dict[str, Dict[str, Any]]:
+    checks: Dict[str, Dict[str, Any]] = {}
+    if args.max_error_rate is not None:
+        error_rate = 100.0 - success_rate(totals) if len(totals) > 0 else 0.0
+        checks["Error Rate"] = {
+            "Limit": f"{args.max_error_rate:g}%",
+            "Actual": f"{error_rate:3.3f}%",
+            "Passed": error_rate <= args.max_error_rate,
+        }
+    if args.max_p99 is not None:
+        max_p99 = parse_latency(args.max_p99)
+        p99 = totals.latency_histogram.percentiles([99.0])[99.0]
+        checks["p99 Latency"] = {
+            "Limit": format_latency(max_p99),
+            "Actual": format_latency(p99),
+            "Passed": p99 <= max_p99,
+        }
+    if args.min_rps is not None:
+        span = totals.span()
+        requests_per_second = len(totals) / span if span > 0 else 0.0
+        checks["Requests/sec"] = {
+            "Limit": f"{args.min_rps:g}",
+            "Actual": f"{requests_per_second:.1f}",
+            "Passed": requests_per_second >= args.min_rps,
+        }
+    return checks
+
+
+# Thresholds which the run can no longer meet, even if every request sent in the remaining seconds is fast and
+# succeeds. The number of remaining requests is projected from the rate they have been sent at so far
+def breached_thresholds(args: argparse.Namespace, stats: RunStats, *, elapsed: float, remaining: float) -> List[str]:
+    totals = stats.totals
+    if elapsed <= 0 or len(totals) == 0:
+        return []
+    no_remaining = len(totals) / elapsed * remaining
+    breaches = []
+    if args.max_error_rate is not None:
+        error_rate = (len(totals) - totals.no_successful_results) / (len(totals) + no_remaining) * 100.0
+        if error_rate > args.max_error_rate:
+            breaches.append(f"Error rate will be at least {error_rate:3.3f}%, above {args.max_error_rate:g}%")
+    if args.max_p99 is not None:
+        max_p99 = parse_latency(args.max_p99)
+        histogram = totals.latency_histogram
+        no_slow = histogram.total_count - histogram.cumulative_counts([max_p99])[0]
+        # The p99 latency is above the limit once more than 1% of responses are
+        if no_slow > (histogram.total_count + no_remaining) / 100:
+            breaches.append(f"p99 latency will be above {format_latency(max_p99)}")
+    # Only a fixed schedule bounds how many more requests can be sent
+    if args.min_rps is not None and stats.schedule is not None:
+        requests_per_second = (len(totals) + stats.schedule.rate * remaining) / (elapsed + remaining)
+        if requests_per_second < args.min_rps:
+            breaches.append(f"Requests/sec will be at most {requests_per_second:.1f}, below {args.min_rps:g}")
+    return breaches
+
+
+THRESHOLD_CHECK_INTERVAL = 1.0
+
+
+# With --abort-on-breach, ends the test once a threshold can no longer be met, adding the reasons to breaches
+async def enforce_thresholds(
+    *,
+    args: argparse.Namespace,
+    get_stats: Callable[[], RunStats],
+    shutdown_event: asyncio.Event,
+    breaches: List[str],
+) -> None:
+    duration = durationpy.from_str(args.duration).total_seconds()
+    start_time = time.monotonic()
+    while not shutdown_event.is_set():
+        try:
+            await asyncio.wait_for(shutdown_event.wait(), timeout=THRESHOLD_CHECK_INTERVAL)
+            return
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.monotonic() - start_time
+        breaches.extend(breached_thresholds(args, get_stats(), elapsed=elapsed, remaining=max(duration - elapsed, 0.0)))
+        if breaches:
+            shutdown_event.set()
 
-    async def renderer() -> None:
+
+# Starts the tasks which report on and watch over a running test
+def install_monitors(
+    args: argparse.Namespace,
+    *,
+    get_stats: Callable[[], RunStats],
+    shutdown_event: asyncio.Event,
+    breaches: List[str],
+) -> List[Awaitable]:
+    tasks = install_shutdown_triggers(args, shutdown_event)
+    if _str_to_bool(args.headless, default=False):
+        tasks.append(reporter(args=args, get_stats=get_stats, shutdown_event=shutdown_event))
+    # Without a terminal to redraw, only the final summary is printed
+    elif sys.stdout.isatty():
+        tasks.append(renderer(args=args, get_stats=get_stats, shutdown_event=shutdown_event))
+    if args.metrics_listen is not None:
+        tasks.append(serve_metrics(args=args, get_stats=get_stats, shutdown_event=shutdown_event))
+    if _str_to_bool(args.abort_on_breach, default=False):
+        tasks.append(
+            enforce_thresholds(args=args, get_stats=get_stats, shutdown_event=shutdown_event, breaches=breaches)
+        )
+    return tasks
+
+
+# Prints the summary of the whole test, and exits with status 1 if it broke a threshold
+def finish(args: argparse.Namespace, stats: RunStats, breaches: Sequence[str]) -> None:
+    summary = build_stats(url=args.url, method=args.method, stats=stats, scenario=args.scenario)
+    checks = check_thresholds(args, stats.totals)
+    if checks:
+        summary["Thresholds"] = checks
+    if breaches:
+        summary["Aborted"] = list(breaches)
+    # Headless output is one JSON document per line
+    if _str_to_bool(args.headless, default=False) and args.output_format == "json":
+        print(json.dumps(summary, separators=(",", ":")))
+    else:
+        print(render_stats(summary, _format=args.output_format))
+    if breaches or not all(check["Passed"] for check in checks.values()):
+        sys.exit(1)
+
+
+async def renderer(
+    *, args: argparse.Namespace, get_stats: Callable[[], RunStats], shutdown_event: asyncio.Event
+) -> None:
+    terminal = TerminalRenderer()
+    interval = RENDER_INTERVAL
+    last_stats = None
+    try:
         while True:
             if shutdown_event.is_set():
                 return
 
-            stats = build_stats(url=args.url, method=args.method, results=results)
-            output = render_stats(stats, _format=args.output_format)
-
-            os.system("clear")
-            print(output, flush=True)
+            stats = build_stats(url=args.url, method=args.method, stats=get_stats(), scenario=args.scenario)
+            if stats != last_stats:
+                terminal.draw(render_stats(stats, _format=args.output_format))
+                last_stats = stats
+
+            # When the event loop is falling behind, render less often to leave it more time for requests
+            expected_wakeup = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            lag = time.monotonic() - expected_wakeup
+            if lag > interval / 2:
+                interval = min(interval * 2, MAX_RENDER_INTERVAL)
+            else:
+                interval = max(interval * 0.9, RENDER_INTERVAL)
+    finally:
+        terminal.stop()
+
+
+# seconds is the length of the interval the results were collected over
+def interval_report(results: ResultAggregate, seconds: float, *, in_flight: int) -> Dict[str, Any]:
+    percentiles = results.latency_histogram.percentiles(WINDOW_PERCENTILES)
+    latency_ns = {format_percentile(percentile): percentiles[percentile] for percentile in WINDOW_PERCENTILES}
+    latency_ns["max"] = results.latency_histogram.max()
+    return {
+        "timestamp_ns": time.time_ns(),
+        "interval_ns": int(seconds * 1_000_000_000),
+        "requests": results.no_results,
+        "successful_requests": results.no_successful_results,
+        "success_ratio": results.no_successful_results / results.no_results if results.no_results > 0 else None,
+        "requests_per_second": results.no_results / seconds,
+        "response_bytes_per_second": results.sum_response_bytes / seconds,
+        "request_bytes_per_second": results.sum_request_bytes / seconds,
+        "latency_ns": latency_ns,
+        "reasons": {REASONS.name(reason_id): count for reason_id, count in results.reason_counts.items()},
+        "in_flight": in_flight,
+    }
 
-            await asyncio.sleep(0.1)
 
-    tasks.append(renderer())
+# Prints a JSON line of stats for each --report-interval. The stats of an interval are the difference between the
+# totals at its end and at its start, so each line costs the same however many requests there were
+async def reporter(
+    *, args: argparse.Namespace, get_stats: Callable[[], RunStats], shutdown_event: asyncio.Event
+) -> None:
+    interval = durationpy.from_str(args.report_interval).total_seconds()
+    previous = ResultAggregate(significant_digits=args.latency_significant_digits)
+    previous_time = time.perf_counter_ns()
+    while not shutdown_event.is_set():
+        try:
+            await asyncio.wait_for(shutdown_event.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        now = time.perf_counter_ns()
+        stats = get_stats()
+        # Copy the totals, which keep changing as results arrive
+        current = ResultAggregate(significant_digits=args.latency_significant_digits)
+        current.merge(stats.totals)
+        delta = ResultAggregate(significant_digits=args.latency_significant_digits)
+        delta.merge(current)
+        delta.subtract(previous)
+        report = interval_report(delta, (now - previous_time) / 1_000_000_000, in_flight=stats.in_flight)
+        print(json.dumps(report, separators=(",", ":")), flush=True)
+        previous = current
+        previous_time = now
+
+
+async def generate_load(
+    *,
+    args: argparse.Namespace,
+    results: ResultHistory,
+    stats: RunStats,
+    connector: PoolingConnector,
+    shutdown_event: asyncio.Event,
+) -> None:
     timeout = aiohttp.ClientTimeout(connect=args.timeout)
-    connector = aiohttp.TCPConnector(
-        force_close=True, limit=0, resolver=resolver(), verify_ssl=_str_to_bool(args.verify_tls, default=True)
-    )
-    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-
-        async def worker() -> None:
-            while not shutdown_event.is_set():
+    async with aiohttp.ClientSession(
+        timeout=timeout, connector=connector, trace_configs=[build_trace_config()]
+    ) as session:
+
+        scenario = build_scenario(args)
+        # Each process counts in steps of the number of processes from its own index, so ${counter} never repeats
+        counter = itertools.count(args.process_index, args.processes)
+        writers = [writer for writer in (build_result_logger(args), build_result_recorder(args)) if writer is not None]
+
+        async def send(start_time: Optional[int] = None) -> None:
+            scenario_id = scenario.pick()
+            entry = scenario.entries[scenario_id]
+            if entry.body_template is not None:
+                data: Optional[Body] = entry.body_template.render(next(counter))
+            else:
+                data = entry.body
+            stats.in_flight += 1
+            try:
                 result = await request(
-                    url=args.url,
-                    method=args.method,
+                    url=entry.url,
+                    method=entry.method,
+                    headers=entry.headers,
+                    data=data,
                     session=session,
                     follow_redirects=_str_to_bool(args.follow_redirects, default=True),
+                    start_time=start_time,
+                    body_mode=args.body_mode,
+                    body_checksum=args.body_checksum,
+                    scenario_id=scenario_id,
                 )
-                results.append(result)
+            finally:
+                stats.in_flight -= 1
+            results.append(result)
+            stats.totals.add(result)
+            stats.windows.add(result)
+            for writer in writers:
+                writer.log(result)
+
+        async def worker() -> None:
+            while not shutdown_event.is_set():
+                await send()
+
+        # Open model: requests are sent on a fixed schedule independent of completions, with --workers bounding the
+        # number of requests in flight. Slots which find every worker busy are dropped rather than delayed
+        async def scheduler(schedule: ScheduleStats) -> None:
+            in_flight: Set[asyncio.Future] = set()
+
+            # Slot times are computed from the start of the schedule rather than accumulated, so they do not drift
+            start_time = time.perf_counter_ns()
+            slot = 0
+            next_time = start_time
+            while not shutdown_event.is_set():
+                now = time.perf_counter_ns()
+                if now < next_time:
+                    # Slots may be hours apart at low rates, so wake up for shutdown too
+                    try:
+                        await asyncio.wait_for(shutdown_event.wait(), timeout=(next_time - now) / 1_000_000_000)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                # Catch up on every slot that has come due since the last iteration
+                while next_time <= now:
+                    schedule.no_scheduled += 1
+                    if len(in_flight) >= args.workers:
+                        schedule.no_dropped += 1
+                    else:
+                        if now - next_time > SCHEDULE_LATENESS_THRESHOLD:
+                            schedule.no_late += 1
+                        future = asyncio.ensure_future(send(next_time))
+                        future.add_done_callback(in_flight.discard)
+                        in_flight.add(future)
+                    slot += 1
+                    next_time = start_time + int(slot * 1_000_000_000 / schedule.rate)
+
+            if in_flight:
+                await asyncio.wait(in_flight)
+
+        try:
+            if stats.schedule is not None:
+                await scheduler(stats.schedule)
+            else:
+                await asyncio.gather(*(worker() for _ in range(args.workers)))
+        finally:
+            for writer in writers:
+                writer.close()
+
+
+def build_schedule(args: argparse.Namespace) -> Optional[ScheduleStats]:
+    if args.rate is None:
+        return None
+    return ScheduleStats(rate=parse_rate(args.rate))
+
+
+def build_run_stats(args: argparse.Namespace, *, results: ResultAggregate, connections: ConnectionStats) -> RunStats:
+    return RunStats(
+        results=results,
+        totals=ResultAggregate(significant_digits=args.latency_significant_digits),
+        windows=TimeWindows(significant_digits=args.latency_significant_digits),
+        connections=connections,
+        schedule=build_schedule(args),
+    )
 
-        for _ in range(args.workers):
-            tasks.append(worker())
-        await asyncio.gather(*tasks)
+
+async def main(args: argparse.Namespace, *, breaches: List[str]) -> RunStats:
+    results = ResultHistory(maxlen=args.request_history, significant_digits=args.latency_significant_digits)
+    connector = build_connector(args)
+    stats = build_run_stats(args, results=results.aggregate, connections=connector.stats)
+
+    def get_stats() -> RunStats:
+        stats.windows.advance(time.perf_counter_ns())
+        return stats
+
+    shutdown_event = asyncio.Event()
+    tasks = install_monitors(args, get_stats=get_stats, shutdown_event=shutdown_event, breaches=breaches)
+    tasks.append(
+        generate_load(args=args, results=results, stats=stats, connector=connector, shutdown_event=shutdown_event)
+    )
+    await asyncio.gather(*tasks)
+    return get_stats()
+
+
+# A single-writer, multiple-reader slot in shared memory holding the latest pickled snapshot published by a process.
+# The sequence number is odd while a snapshot is being written, so readers can detect and retry torn reads. Snapshots
+# grow with the number of distinct reasons and backends, so the slot grows to fit, and readers follow the length
+class SharedSnapshot(object):
+    HEADER = struct.Struct("QQ")
+
+    def __init__(self, *, capacity: int = 1024 * 1024):
+        # Unlike anonymous mappings, a file mapped with MAP_SHARED can be grown and still be shared across fork()
+        self.file = tempfile.TemporaryFile()
+        self.file.truncate(self.HEADER.size + capacity)
+        self.buffer = mmap.mmap(self.file.fileno(), 0)
+        self.last: Any = None
+
+    @property
+    def capacity(self) -> int:
+        return len(self.buffer) - self.HEADER.size
+
+    def _remap(self) -> None:
+        self.buffer.close()
+        self.buffer = mmap.mmap(self.file.fileno(), 0)
+
+    def publish(self, snapshot: Any) -> None:
+        payload = pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        sequence, _ = self.HEADER.unpack_from(self.buffer)
+        self.HEADER.pack_into(self.buffer, 0, sequence + 1, 0)
+        if len(payload) > self.capacity:
+            self.file.truncate(self.HEADER.size + max(2 * self.capacity, len(payload)))
+            self._remap()
+        start = self.HEADER.size
+        end = start + len(payload)
+        self.buffer[start:end] = payload
+        self.HEADER.pack_into(self.buffer, 0, sequence + 2, len(payload))
+
+    def read(self, *, attempts: int = 100) -> Any:
+        for _ in range(attempts):
+            sequence, length = self.HEADER.unpack_from(self.buffer)
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            if sequence == 0:
+                return None
+            start = self.HEADER.size
+            end = start + length
+            if end > len(self.buffer):
+                # The writer has grown the file since this mapping was made
+                self._remap()
+                continue
+            payload = self.buffer[start:end]
+            if self.HEADER.unpack_from(self.buffer)[0] == sequence:
+                self.last = pickle.loads(payload)
+                break
+        # If the writer kept us out, fall back on the last complete snapshot
+        return self.last
+
+    def close(self) -> None:
+        self.buffer.close()
+        self.file.close()
+
+
+def _share(total: int, processes: int, index: int) -> int:
+    return total // processes + (1 if index < total % processes else 0)
+
+
+# Splits the load described by args evenly across processes
+def load_process_args(args: argparse.Namespace, *, processes: int, index: int) -> argparse.Namespace:
+    process_args = argparse.Namespace(**vars(args))
+    process_args.workers = _share(args.workers, processes, index)
+    process_args.request_history = max(_share(args.request_history, processes, index), 1)
+    if args.max_connections:
+        process_args.max_connections = _share(args.max_connections, processes, index)
+    if args.rate is not None:
+        process_args.rate = f"{parse_rate(args.rate) / processes}/s"
+    if args.record is not None:
+        process_args.record = f"{args.record}.{index}"
+    process_args.process_index = index
+    return process_args
+
+
+# Forked load processes inherit the random state of the parent, so without reseeding they would all send the same
+# ${random} bodies and pick scenario entries in the same order
+def reseed(args: argparse.Namespace) -> None:
+    random.seed()
+    body_templates = [args.body_template]
+    if args.scenario is not None:
+        args.scenario.random.seed()
+        body_templates.extend(entry.body_template for entry in args.scenario.entries)
+    for body_template in body_templates:
+        if body_template is not None:
+            body_template.random.seed()
+
+
+SNAPSHOT_INTERVAL = 0.1
+
+
+async def load_process_main(
+    args: argparse.Namespace, snapshot: SharedSnapshot, stop_event: multiprocessing.synchronize.Event
+) -> None:
+    results = ResultHistory(maxlen=args.request_history, significant_digits=args.latency_significant_digits)
+    connector = build_connector(args)
+    stats = build_run_stats(args, results=results.aggregate, connections=connector.stats)
+    shutdown_event = asyncio.Event()
+
+    async def publisher() -> None:
+        while not shutdown_event.is_set():
+            stats.windows.advance(time.perf_counter_ns())
+            snapshot.publish(stats)
+            if stop_event.is_set():
+                shutdown_event.set()
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+
+    await asyncio.gather(
+        publisher(),
+        generate_load(args=args, results=results, stats=stats, connector=connector, shutdown_event=shutdown_event),
+    )
+    stats.windows.advance(time.perf_counter_ns())
+    snapshot.publish(stats)
+
+
+def run_load_process(
+    args: argparse.Namespace, snapshot: SharedSnapshot, stop_event: multiprocessing.synchronize.Event
+) -> None:
+    # The parent process handles signals and tells load processes when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    reseed(args)
+    asyncio.run(load_process_main(args, snapshot, stop_event))
+
+
+def merged_stats(args: argparse.Namespace, snapshots: Sequence[SharedSnapshot]) -> RunStats:
+    stats = build_run_stats(
+        args,
+        results=ResultAggregate(significant_digits=args.latency_significant_digits),
+        connections=ConnectionStats(),
+    )
+    if stats.schedule is not None:
+        stats.schedule.rate = 0.0
+    for snapshot in snapshots:
+        process_stats = snapshot.read()
+        if process_stats is not None:
+            stats.merge(process_stats)
+    return stats
+
+
+# Runs load processes and renders their merged stats
+async def monitor(
+    args: argparse.Namespace,
+    snapshots: List[SharedSnapshot],
+    processes: Sequence[multiprocessing.process.BaseProcess],
+    *,
+    breaches: List[str],
+) -> None:
+    def get_stats() -> RunStats:
+        return merged_stats(args, snapshots)
+
+    shutdown_event = asyncio.Event()
+
+    async def watch_processes() -> None:
+        while not shutdown_event.is_set():
+            if not any(process.is_alive() for process in processes):
+                shutdown_event.set()
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+
+    tasks = install_monitors(args, get_stats=get_stats, shutdown_event=shutdown_event, breaches=breaches)
+    tasks.append(watch_processes())
+    await asyncio.gather(*tasks)
+
+
+# Returns the merged stats of every load process once they have all stopped
+def run_processes(args: argparse.Namespace, *, breaches: List[str]) -> RunStats:
+    # Processes are forked before any event loop exists so that each starts with a clean slate
+    context = multiprocessing.get_context("fork")
+    stop_event = context.Event()
+    snapshots = [SharedSnapshot() for _ in range(args.processes)]
+    processes = [
+        context.Process(
+            target=run_load_process,
+            args=(load_process_args(args, processes=args.processes, index=index), snapshot, stop_event),
+            daemon=True,
+        )
+        for index, snapshot in enumerate(snapshots)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        asyncio.run(monitor(args, snapshots, processes, breaches=breaches))
+    finally:
+        stop_event.set()
+        for process in processes:
+            process.join(timeout=args.timeout + 1.0)
+            if process.is_alive():
+                process.terminate()
+    try:
+        return merged_stats(args, snapshots)
+    finally:
+        for snapshot in snapshots:
+            snapshot.close()
+
+
+EVENT_LOOPS = ("asyncio", "uvloop")
+
+
+# Returns None when the named event loop is not installed
+def event_loop_policy(name: str) -> Optional[asyncio.AbstractEventLoopPolicy]:
+    if name == "uvloop":
+        try:
+            import uvloop  # type: ignore
+        except ImportError:
+            return None
+        return uvloop.EventLoopPolicy()
+    return asyncio.DefaultEventLoopPolicy()
+
+
+def install_event_loop(args: argparse.Namespace) -> None:
+    policy = event_loop_policy(args.loop)
+    if policy is None:
+        print(f"{args.loop} is not installed, falling back to asyncio", file=sys.stderr)
+        args.loop = "asyncio"
+        policy = asyncio.DefaultEventLoopPolicy()
+    asyncio.set_event_loop_policy(policy)
+
+
+def parse_bench_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="webtop bench",
+        description="Compare event loops by load testing a local server under each of them",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--loops", metavar="LOOP", nargs="+", choices=EVENT_LOOPS, default=list(EVENT_LOOPS))
+    parser.add_argument("-k", "--workers", metavar="N", type=int, help="Number of parallel workers", default=64)
+    parser.add_argument("-d", "--duration", metavar="TIME", type=str, help="Duration of each run", default="5s")
+    parser.add_argument(
+        "-o", "--output-format", metavar="FORMAT", choices=("json", "yaml"), help="Output format", default="json"
+    )
+    return parser.parse_args(argv)
+
+
+def run_bench_server(connection: multiprocessing.connection.Connection) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    async def handle(_: web.Request) -> web.Response:
+        return web.Response(body=b"OK")
+
+    async def serve() -> None:
+        app = web.Application()
+        app.router.add_get("/", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        connection.send(runner.addresses[0][1])
+        # Serve until the benchmark terminates this process
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+async def bench_client(args: argparse.Namespace) -> ResultAggregate:
+    results = ResultHistory(maxlen=args.request_history, significant_digits=args.latency_significant_digits)
+    connector = build_connector(args)
+    stats = build_run_stats(args, results=results.aggregate, connections=connector.stats)
+    shutdown_event = asyncio.Event()
+    tasks = install_shutdown_triggers(args, shutdown_event)
+    tasks.append(
+        generate_load(args=args, results=results, stats=stats, connector=connector, shutdown_event=shutdown_event)
+    )
+    await asyncio.gather(*tasks)
+    return stats.totals
+
+
+def run_bench_client(args: argparse.Namespace, connection: multiprocessing.connection.Connection) -> None:
+    install_event_loop(args)
+    connection.send(asyncio.run(bench_client(args)))
+
+
+# Runs the same keep-alive load against a local server under each event loop in turn. The server and each client run
+# in their own processes, so the client being measured has a core and an event loop to itself
+def bench(argv: Sequence[str]) -> None:
+    bench_args = parse_bench_args(argv)
+    context = multiprocessing.get_context("fork")
+    server_connection, server_child_connection = context.Pipe()
+    server = context.Process(target=run_bench_server, args=(server_child_connection,), daemon=True)
+    server.start()
+    try:
+        url = f"http://127.0.0.1:{server_connection.recv()}/"
+        summary: Dict[str, Any] = {}
+        for loop in bench_args.loops:
+            if event_loop_policy(loop) is None:
+                summary[loop] = "not installed"
+                continue
+            args = parse_args(
+                [url, "-k", str(bench_args.workers), "-d", bench_args.duration, "--keepalive", "true", "--loop", loop]
+            )
+            connection, child_connection = context.Pipe()
+            client = context.Process(target=run_bench_client, args=(args, child_connection))
+            client.start()
+            totals = connection.recv()
+            client.join()
+            summary[loop] = window_summary(totals, totals.span())
+    finally:
+        server.terminate()
+    print(render_stats(summary, _format=bench_args.output_format))
+
+
+# Commands kept in their own module of the package, which is only imported when one of them is run
+def package_command(module: str, name: str) -> Callable[[Sequence[str]], None]:
+    def command(argv: Sequence[str]) -> None:
+        # Run as a script, the package is not importable until the directory it is in is on the path
+        if not __package__:
+            sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        try:
+            package_module = importlib.import_module(f"webtop.{module}")
+        except ImportError as e:
+            if e.name == f"webtop.{module}":
+                raise
+            sys.exit(f"webtop {name} requires {e.name}")
+        getattr(package_module, name)(argv)
+
+    return command
+
+
+COMMANDS = {
+    "bench": bench,
+    "analyze": package_command("analysis", "analyze"),
+    "compare": package_command("analysis", "compare"),
+}
+
+
+def run() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
+    args = parse_args()
+    assert are_args_valid(args)
+    # Load processes are forked after this, so they inherit the event loop policy
+    install_event_loop(args)
+    prepare_result_log(args)
+
+    breaches: List[str] = []
+    if args.processes > 1:
+        stats = run_processes(args, breaches=breaches)
+    else:
+        stats = asyncio.run(main(args, breaches=breaches))
+    finish(args, stats, breaches)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()
@@ -0,0 +1,481 @@
+# Offline tooling for recordings made with --record: the analyze and compare commands
+
+from typing import Dict, Any, List, Sequence, Tuple
+from webtop import (
+    LATENCY_PERCENTILES,
+    NO_BACKEND,
+    PHASES,
+    RECORD,
+    RECORD_FIELDS,
+    RECORDING_LENGTH,
+    RECORDING_MAGIC,
+    TRAILER_MAGIC,
+    WINDOW_PERCENTILES,
+    InternTable,
+    duration_is_valid,
+    format_bandwidth,
+    format_latency,
+    format_percentile,
+    record_padding,
+    render_stats,
+)
+import argparse
+import durationpy  # type: ignore
+import glob
+import json
+import math
+import mmap
+import numpy as np  # type: ignore
+import os
+import re
+import sys
+
+
+def parse_analyze_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="webtop analyze",
+        description="Summarize recordings made with --record. Requires numpy",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "files",
+        metavar="FILE",
+        nargs="+",
+        help="Recordings of the same run. A --record FILE from a run with --processes stands for all of FILE.N",
+    )
+    parser.add_argument(
+        "--interval", metavar="TIME", type=str, help="Length of each step of the time series", default="1s"
+    )
+    parser.add_argument(
+        "-o", "--output-format", metavar="FORMAT", choices=("json", "yaml"), help="Output format", default="json"
+    )
+    return parser.parse_args(argv)
+
+
+class Recording(object):
+    def __init__(self, *, header: Dict[str, Any], records: Any, reasons: List[str], backends: List[str]):
+        self.header = header
+        # A numpy structured array of RECORD_FIELDS
+        self.records = records
+        self.reasons = reasons
+        self.backends = backends
+
+
+def load_recording(path: str) -> Recording:
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[: len(RECORDING_MAGIC)] != RECORDING_MAGIC:
+        raise ValueError(f"{path} is not a webtop recording")
+    (header_length,) = RECORDING_LENGTH.unpack_from(buffer, len(RECORDING_MAGIC))
+    header_start = len(RECORDING_MAGIC) + RECORDING_LENGTH.size
+    header_end = header_start + header_length
+    header = json.loads(buffer[header_start:header_end])
+    records_start = header_end + record_padding(header_length)
+
+    records_end = len(buffer)
+    trailer: Dict[str, List[str]] = {"reasons": [], "backends": []}
+    magic_start = records_end - len(TRAILER_MAGIC)
+    if buffer[magic_start:records_end] == TRAILER_MAGIC:
+        length_start = magic_start - RECORDING_LENGTH.size
+        (trailer_length,) = RECORDING_LENGTH.unpack_from(buffer, length_start)
+        records_end = length_start - trailer_length
+        trailer = json.loads(buffer[records_end:length_start])
+
+    dtype = np.dtype(
+        {
+            "names": [name for name, _ in RECORD_FIELDS],
+            "formats": [_format for _, _format in RECORD_FIELDS],
+            "itemsize": RECORD.size,
+        }
+    )
+    count = (records_end - records_start) // RECORD.size
+    records = np.frombuffer(buffer, dtype=dtype, count=count, offset=records_start)
+    return Recording(header=header, records=records, reasons=trailer["reasons"], backends=trailer["backends"])
+
+
+# Combines recordings from the processes of a run. Reason and backend ids are translated into a shared table of names
+def combine_recordings(recordings: Sequence[Recording]) -> Tuple[Dict[str, Any], List[str], List[str]]:
+    reasons = InternTable()
+    backends = InternTable()
+    columns: Dict[str, List[Any]] = {name: [] for name, _ in RECORD_FIELDS}
+    for recording in recordings:
+        records = recording.records
+        reason_names = recording.reasons or [
+            f"Reason {reason_id}" for reason_id in range(records["reason_id"].max(initial=0) + 1)
+        ]
+        backend_names = recording.backends or [
+            "" if backend_id == NO_BACKEND else f"Backend {backend_id}"
+            for backend_id in range(records["backend_id"].max(initial=0) + 1)
+        ]
+        for name, _ in RECORD_FIELDS:
+            columns[name].append(records[name])
+        columns["reason_id"][-1] = np.array([reasons.intern(name) for name in reason_names])[records["reason_id"]]
+        columns["backend_id"][-1] = np.array([backends.intern(name) for name in backend_names])[records["backend_id"]]
+    combined = {name: np.concatenate(parts) if len(parts) > 1 else parts[0] for name, parts in columns.items()}
+    order = np.argsort(combined["timestamp_ns"], kind="stable")
+    return {name: column[order] for name, column in combined.items()}, reasons.names, backends.names
+
+
+# The recordings --record FILE produced, which are FILE.N when the run had several processes. A run with a different
+# number of processes leaves the other kind behind, and reading it instead would silently analyze a stale run
+def recording_paths(path: str) -> List[str]:
+    pattern = re.compile(rf"{re.escape(path)}\.(\d+)")
+    indexes = {}
+    for process_path in glob.glob(f"{glob.escape(path)}.[0-9]*"):
+        match = pattern.fullmatch(process_path)
+        if match is not None:
+            indexes[process_path] = int(match.group(1))
+    if not indexes:
+        return [path]
+    if os.path.exists(path):
+        raise ValueError(f"Both {path} and {path}.N recordings exist, remove or rename the ones from the other run")
+    return sorted(indexes, key=indexes.__getitem__)
+
+
+def load_recordings(paths: Sequence[str]) -> List[Recording]:
+    try:
+        return [load_recording(process_path) for path in paths for process_path in recording_paths(path)]
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+
+
+# Nearest-rank percentiles of already sorted values, matching Histogram.percentiles()
+def sorted_percentiles(values: Any, percentiles: Sequence[float]) -> List[int]:
+    if len(values) == 0:
+        return [0] * len(percentiles)
+    ranks = np.maximum(np.ceil(np.array(percentiles) / 100.0 * len(values)).astype(np.int64) - 1, 0)
+    return [int(value) for value in values[ranks]]
+
+
+def analyzed_latency(values: Any, percentiles: Sequence[float]) -> Dict[str, str]:
+    values = np.sort(values)
+    summary = {"min": format_latency(int(values[0]) if len(values) else 0)}
+    for percentile, value in zip(percentiles, sorted_percentiles(values, percentiles)):
+        summary[format_percentile(percentile)] = format_latency(value)
+    summary["max"] = format_latency(int(values[-1]) if len(values) else 0)
+    return summary
+
+
+# Per-group counts and latency percentiles, computed with one sort rather than a pass per group
+def analyzed_groups(
+    keys: Any, values: Any, include: Any, success: Any, names: Sequence[str]
+) -> Dict[str, Dict[str, Any]]:
+    group_ids, counts = np.unique(keys, return_counts=True)
+    successes = np.bincount(keys, weights=success, minlength=len(names))
+    order = np.lexsort((values[include], keys[include]))
+    sorted_keys = keys[include][order]
+    sorted_values = values[include][order]
+    latency_ids, starts, latency_counts = np.unique(sorted_keys, return_index=True, return_counts=True)
+    latencies: Dict[int, Dict[str, str]] = {}
+    for group_id, start, count in zip(latency_ids, starts, latency_counts):
+        end = start + count
+        group_values = sorted_values[start:end]
+        summary = {"min": format_latency(int(group_values[0]))}
+        for percentile, value in zip(WINDOW_PERCENTILES, sorted_percentiles(group_values, WINDOW_PERCENTILES)):
+            summary[format_percentile(percentile)] = format_latency(value)
+        summary["max"] = format_latency(int(group_values[-1]))
+        latencies[int(group_id)] = summary
+    return {
+        names[group_id]: {
+            "Count": int(count),
+            "Success Rate": f"{successes[group_id] / count * 100.0:3.3f}%",
+            "Latency": latencies.get(int(group_id), {}),
+        }
+        for group_id, count in zip(group_ids, counts)
+    }
+
+
+def analyzed_time_series(columns: Dict[str, Any], success: Any, interval_ns: int) -> List[Dict[str, Any]]:
+    timestamps = columns["timestamp_ns"]
+    if len(timestamps) == 0:
+        return []
+    steps = (timestamps - timestamps[0]) // interval_ns
+    counts = np.bincount(steps)
+    successes = np.bincount(steps, weights=success)
+    order = np.lexsort((columns["elapsed_ns"], steps))
+    sorted_steps = steps[order]
+    sorted_elapsed = columns["elapsed_ns"][order]
+    starts = np.searchsorted(sorted_steps, np.arange(len(counts)))
+    series = []
+    for step, (start, count) in enumerate(zip(starts, counts)):
+        if count == 0:
+            continue
+        end = start + count
+        step_elapsed = sorted_elapsed[start:end]
+        p50, p90, p99 = sorted_percentiles(step_elapsed, WINDOW_PERCENTILES)
+        series.append(
+            {
+                "Offset": f"{step * interval_ns / 1_000_000_000:g}s",
+                "Requests/sec": f"{count / (interval_ns / 1_000_000_000):.1f}",
+                "Success Rate": f"{successes[step] / count * 100.0:3.3f}%",
+                "p50": format_latency(p50),
+                "p90": format_latency(p90),
+                "p99": format_latency(p99),
+            }
+        )
+    return series
+
+
+# Recomputes the summary build_stats() shows from recordings, over every request rather than the request history.
+# Statistics which are not kept per request, such as retired connections, DNS and schedule counts, are not available
+def analyze_recordings(recordings: Sequence[Recording], interval_ns: int) -> Dict[str, Any]:
+    columns, reason_names, backend_names = combine_recordings(recordings)
+    header = recordings[0].header
+    status = columns["status"]
+    elapsed = columns["elapsed_ns"]
+    no_results = len(status)
+    is_response = status != 0
+    success = ((status >= 200) & (status < 400)).astype(np.int64)
+    no_responses = int(is_response.sum())
+    response_elapsed = elapsed[is_response]
+    timestamps = columns["timestamp_ns"]
+    span = (int(timestamps[-1]) - int(timestamps[0])) / 1_000_000_000 if no_results else 0.0
+
+    summary: Dict[str, Any] = {}
+    if header.get("scenario") is not None:
+        summary["Scenario"] = header["scenario"]
+    else:
+        summary["URL"] = header.get("url")
+        summary["Verb"] = header.get("method")
+    summary["Sample Size"] = no_results
+    summary["Success Rate"] = f"{success.sum() / max(no_results, 1) * 100.0:3.9f}%"
+    summary["Average Latency"] = format_latency(float(response_elapsed.mean()) if no_responses else 0.0)
+    summary["Latency Percentiles"] = analyzed_latency(response_elapsed, LATENCY_PERCENTILES)
+
+    phases = {}
+    for phase in PHASES:
+        phase_ns = columns[f"{phase.lower()}_ns"]
+        phase_ns = phase_ns[is_response & (phase_ns >= 0)]
+        if len(phase_ns):
+            phases[phase] = analyzed_latency(phase_ns, LATENCY_PERCENTILES)
+    summary["Latency by Phase"] = phases
+
+    everything = np.ones(no_results, dtype=bool)
+    summary["Count by Reason"] = analyzed_groups(
+        columns["reason_id"].astype(np.int64), elapsed, everything, success, reason_names
+    )
+    backend_ids = columns["backend_id"].astype(np.int64)
+    known_backend = np.array([name != "" for name in backend_names], dtype=bool)[backend_ids]
+    summary["Backends"] = analyzed_groups(
+        backend_ids[known_backend],
+        elapsed[known_backend],
+        is_response[known_backend],
+        success[known_backend],
+        backend_names,
+    )
+    if header.get("scenario") is not None:
+        summary["Scenarios"] = analyzed_groups(
+            columns["scenario_id"].astype(np.int64), elapsed, is_response, success, header["scenario_names"]
+        )
+
+    new_connection = columns["new_connection"].astype(bool)
+    no_new_connections = int(new_connection.sum())
+    no_reused_connections = int((is_response & ~new_connection).sum())
+    no_connected_results = max(no_reused_connections + no_new_connections, 1)
+    summary["Connections"] = {
+        "Reuse Ratio": f"{no_reused_connections / no_connected_results * 100.0:3.3f}%",
+        "New Connections/sec": f"{no_new_connections / span if span > 0 else 0.0:.1f}",
+    }
+
+    sizes = np.sort(columns["response_bytes"][is_response])
+    size_percentiles = sorted_percentiles(sizes, WINDOW_PERCENTILES)
+    body: Dict[str, Any] = {
+        "Size": {
+            "min": int(sizes[0]) if len(sizes) else 0,
+            **{format_percentile(percentile): value for percentile, value in zip(WINDOW_PERCENTILES, size_percentiles)},
+            "max": int(sizes[-1]) if len(sizes) else 0,
+        }
+    }
+    body_ns = columns["body_ns"][is_response]
+    sum_body_ns = int(body_ns[body_ns >= 0].sum())
+    if sum_body_ns > 0:
+        body["Transfer Rate"] = format_bandwidth(int(sizes.sum()) / (sum_body_ns / 1_000_000_000))
+    checksum = columns["checksum"]
+    if (checksum > 0).any():
+        body["Checksum Mismatches"] = int((checksum == 2).sum())
+    summary["Body"] = body
+
+    if span > 0:
+        summary["Throughput"] = {
+            "Requests/sec": f"{no_results / span:.1f}",
+            "Successful Requests/sec": f"{success.sum() / span:.1f}",
+            "Response Bytes/sec": format_bandwidth(int(columns["response_bytes"].sum()) / span),
+            "Request Bytes/sec": format_bandwidth(int(columns["request_bytes"].sum()) / span),
+        }
+    summary["Time Series"] = analyzed_time_series(columns, success, interval_ns)
+    return summary
+
+
+def analyze(argv: Sequence[str]) -> None:
+    analyze_args = parse_analyze_args(argv)
+    if not duration_is_valid(analyze_args.interval):
+        sys.exit(f"Invalid interval {analyze_args.interval}")
+    interval_ns = max(int(durationpy.from_str(analyze_args.interval).total_seconds() * 1_000_000_000), 1)
+    recordings = load_recordings(analyze_args.files)
+    summary = analyze_recordings(recordings, interval_ns)
+    print(render_stats(summary, _format=analyze_args.output_format))
+
+
+def parse_compare_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="webtop compare",
+        description="Compare two recordings made with --record, exiting with status 1 if the candidate regressed. "
+        "Requires numpy",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("baseline", metavar="BASELINE", help="Recording of the baseline run")
+    parser.add_argument("candidate", metavar="CANDIDATE", help="Recording of the run to check for regressions")
+    parser.add_argument(
+        "--max-latency-increase",
+        metavar="PERCENT",
+        type=float,
+        help="Largest acceptable increase in p99 latency, which must also be statistically significant",
+        default=10.0,
+    )
+    parser.add_argument(
+        "--max-throughput-decrease",
+        metavar="PERCENT",
+        type=float,
+        help="Largest acceptable decrease in requests/sec",
+        default=10.0,
+    )
+    parser.add_argument(
+        "--max-success-rate-decrease",
+        metavar="POINTS",
+        type=float,
+        help="Largest acceptable decrease in success rate, in percentage points",
+        default=1.0,
+    )
+    parser.add_argument(
+        "--significance",
+        metavar="P",
+        type=float,
+        help="p-value below which the Mann-Whitney U test counts a latency shift as significant",
+        default=0.01,
+    )
+    parser.add_argument(
+        "-o", "--output-format", metavar="FORMAT", choices=("json", "yaml"), help="Output format", default="json"
+    )
+    return parser.parse_args(argv)
+
+
+class RunMetrics(object):
+    def __init__(self, recordings: Sequence[Recording]):
+        columns, reason_names, _ = combine_recordings(recordings)
+        status = columns["status"]
+        timestamps = columns["timestamp_ns"]
+        self.no_results = len(status)
+        self.span = (int(timestamps[-1]) - int(timestamps[0])) / 1_000_000_000 if self.no_results else 0.0
+        self.requests_per_second = self.no_results / self.span if self.span > 0 else 0.0
+        no_successful_results = int(((status >= 200) & (status < 400)).sum())
+        self.success_rate = no_successful_results / self.no_results * 100.0 if self.no_results else 0.0
+        self.latencies = np.sort(columns["elapsed_ns"][status != 0])
+        reason_ids, counts = np.unique(columns["reason_id"], return_counts=True)
+        self.reason_counts = {reason_names[reason_id]: int(count) for reason_id, count in zip(reason_ids, counts)}
+
+
+# Two-sided Mann-Whitney U test with the normal approximation and a correction for ties. Returns U for the candidate,
+# the p-value and the probability that a candidate sample is larger than a baseline sample
+def mann_whitney_u(baseline: Any, candidate: Any) -> Tuple[float, float, float]:
+    no_baseline = len(baseline)
+    no_candidate = len(candidate)
+    if no_baseline == 0 or no_candidate == 0:
+        return 0.0, 1.0, 0.5
+    combined = np.concatenate((baseline, candidate))
+    values, inverse, tie_counts = np.unique(combined, return_inverse=True, return_counts=True)
+    # Tied values share the average of the ranks they span
+    upper_ranks = np.cumsum(tie_counts)
+    average_ranks = upper_ranks - (tie_counts - 1) / 2.0
+    candidate_rank_sum = average_ranks[inverse[no_baseline:]].sum()
+    u = candidate_rank_sum - no_candidate * (no_candidate + 1) / 2.0
+
+    total = no_baseline + no_candidate
+    mean = no_baseline * no_candidate / 2.0
+    tie_correction = float((tie_counts.astype(np.float64) ** 3 - tie_counts).sum()) / (total * (total - 1))
+    variance = no_baseline * no_candidate / 12.0 * ((total + 1) - tie_correction)
+    if variance <= 0:
+        return float(u), 1.0, 0.5
+    z = (u - mean) / math.sqrt(variance)
+    p_value = math.erfc(abs(z) / math.sqrt(2.0))
+    return float(u), p_value, float(u) / (no_baseline * no_candidate)
+
+
+def format_change(baseline: float, candidate: float) -> str:
+    if baseline == 0:
+        return "n/a"
+    return f"{(candidate - baseline) / baseline * 100.0:+.2f}%"
+
+
+def compare_runs(baseline: RunMetrics, candidate: RunMetrics, args: argparse.Namespace) -> Dict[str, Any]:
+    regressions = []
+    report: Dict[str, Any] = {}
+
+    report["Sample Size"] = {"Baseline": baseline.no_results, "Candidate": candidate.no_results}
+
+    throughput_change = format_change(baseline.requests_per_second, candidate.requests_per_second)
+    report["Requests/sec"] = {
+        "Baseline": f"{baseline.requests_per_second:.1f}",
+        "Candidate": f"{candidate.requests_per_second:.1f}",
+        "Change": throughput_change,
+    }
+    if baseline.requests_per_second > 0:
+        decrease = (baseline.requests_per_second - candidate.requests_per_second) / baseline.requests_per_second * 100
+        if decrease > args.max_throughput_decrease:
+            regressions.append(f"Requests/sec fell by {decrease:.2f}%")
+
+    success_rate_change = candidate.success_rate - baseline.success_rate
+    report["Success Rate"] = {
+        "Baseline": f"{baseline.success_rate:3.3f}%",
+        "Candidate": f"{candidate.success_rate:3.3f}%",
+        "Change": f"{success_rate_change:+.3f} points",
+    }
+    if -success_rate_change > args.max_success_rate_decrease:
+        regressions.append(f"Success rate fell by {-success_rate_change:.3f} points")
+
+    baseline_percentiles = sorted_percentiles(baseline.latencies, LATENCY_PERCENTILES)
+    candidate_percentiles = sorted_percentiles(candidate.latencies, LATENCY_PERCENTILES)
+    report["Latency Percentiles"] = {
+        format_percentile(percentile): {
+            "Baseline": format_latency(baseline_value),
+            "Candidate": format_latency(candidate_value),
+            "Change": format_change(baseline_value, candidate_value),
+        }
+        for percentile, baseline_value, candidate_value in zip(
+            LATENCY_PERCENTILES, baseline_percentiles, candidate_percentiles
+        )
+    }
+
+    u, p_value, probability_slower = mann_whitney_u(baseline.latencies, candidate.latencies)
+    report["Mann-Whitney U"] = {
+        "U": u,
+        "p-value": p_value,
+        "P(Candidate Slower)": f"{probability_slower:.4f}",
+    }
+    baseline_p99 = baseline_percentiles[LATENCY_PERCENTILES.index(99.0)]
+    candidate_p99 = candidate_percentiles[LATENCY_PERCENTILES.index(99.0)]
+    if baseline_p99 > 0 and p_value < args.significance and probability_slower > 0.5:
+        increase = (candidate_p99 - baseline_p99) / baseline_p99 * 100
+        if increase > args.max_latency_increase:
+            regressions.append(f"p99 latency rose by {increase:.2f}% (p={p_value:.3g})")
+
+    report["Count by Reason"] = {
+        reason: {
+            "Baseline": baseline.reason_counts.get(reason, 0),
+            "Candidate": candidate.reason_counts.get(reason, 0),
+            "Change": f"{candidate.reason_counts.get(reason, 0) - baseline.reason_counts.get(reason, 0):+d}",
+        }
+        for reason in {**baseline.reason_counts, **candidate.reason_counts}
+    }
+
+    report["Regressions"] = regressions
+    return report
+
+
+def compare(argv: Sequence[str]) -> None:
+    compare_args = parse_compare_args(argv)
+    baseline = RunMetrics(load_recordings([compare_args.baseline]))
+    candidate = RunMetrics(load_recordings([compare_args.candidate]))
+    report = compare_runs(baseline, candidate, compare_args)
+    print(render_stats(report, _format=compare_args.output_format))
+    if report["Regressions"]:
+        sys.exit(1)